@@ -10,6 +10,7 @@ celery = Celery(
     include=[
         'vocab.tasks.pipeline',
         'vocab.tasks.cache',
+        'vocab.tasks.normalize',
         'vocab.tasks.documentation',
         'vocab.tasks.jsonld',
         'vocab.tasks.lov',
@@ -17,6 +18,7 @@ celery = Celery(
         'vocab.tasks.sparql',
         'vocab.tasks.summarizer',
         'vocab.tasks.index',
+        'vocab.tasks.sweeper',
     ],
     task_store_errors_even_if_ignored=True,
     broker_connection_retry_on_startup=True,
@@ -0,0 +1,135 @@
+import sys
+import time
+
+import elementpath
+
+from lxml import etree
+from lxml.etree import Element
+from typing import List, Any
+
+from vocab.cmdi import parse_record, xpath_version
+from vocab.util.xml import ns, ns_prefix, grab_value, grab_first, read_xml, write_xml, xpath_select
+
+
+def create_benchmark_record(versions: int = 25, namespaces: int = 10, items: int = 10) -> Element:
+    def sub(parent: Element, tag: str, text: Any = None) -> Element:
+        elem = etree.SubElement(parent, f"{ns_prefix}{tag}", nsmap=ns)
+        if text is not None:
+            elem.text = str(text)
+        return elem
+
+    def add_namespaces(parent: Element) -> None:
+        namespaces_elem = sub(parent, 'Namespaces')
+        for i in range(namespaces):
+            namespace = sub(namespaces_elem, 'Namespace')
+            sub(namespace, 'URI', f'http://example.org/ns{i}#')
+            sub(namespace, 'prefix', f'ns{i}')
+            sub(namespace, 'count', i * 10)
+
+    def add_namespace_items(parent: Element) -> None:
+        items_elem = sub(parent, 'NamespaceItems')
+        for i in range(namespaces):
+            for j in range(items):
+                item = sub(items_elem, 'NamespaceItem')
+                sub(item, 'URI', f'http://example.org/ns{i}#')
+                sub(item, 'prefix', f'ns{i}')
+                sub(item, 'name', f'Item{j}')
+                sub(item, 'count', j)
+
+    root = etree.Element(f"{ns_prefix}CMD", nsmap=ns)
+    vocabulary = sub(sub(root, 'Components'), 'Vocabulary')
+
+    identification = sub(vocabulary, 'Identification')
+    sub(identification, 'identifier', 'benchmark')
+    sub(identification, 'title', 'Benchmark vocabulary')
+    namespace = sub(identification, 'Namespace')
+    sub(namespace, 'uri', 'http://example.org/')
+    sub(namespace, 'prefix', 'ex')
+
+    responsibility = sub(vocabulary, 'Responsibility')
+    for role in ('Creator', 'Maintainer', 'Contributor'):
+        authority = sub(responsibility, role)
+        sub(authority, 'uri', f'http://example.org/{role.lower()}')
+        sub(authority, 'label', role)
+
+    description = sub(vocabulary, 'Description')
+    sub(description, 'description', 'A large record with  many versions and summaries\n  to parse.')
+    sub(description, 'language', 'en')
+    sub(description, 'topicUnesco', 'Humanities')
+    keywords = sub(description, 'Keywords')
+    sub(keywords, 'label', 'benchmark')
+
+    type_elem = sub(vocabulary, 'Type')
+    sub(type_elem, 'syntax', 'skos')
+    sub(type_elem, 'kos', 'thesaurus')
+
+    location = sub(vocabulary, 'Location')
+    sub(location, 'uri', 'http://example.org/')
+    sub(location, 'type', 'homepage')
+
+    for i in range(versions):
+        version = sub(vocabulary, 'Version')
+        sub(version, 'version', f'{i}.0')
+        sub(version, 'validFrom', f'2020-01-{i % 28 + 1:02d}')
+        for type, recipe in (('dump', None), ('endpoint', 'sparql'), ('homepage', 'doc')):
+            location = sub(version, 'Location')
+            sub(location, 'uri', f'http://example.org/{i}/{type}')
+            sub(location, 'type', type)
+            if recipe:
+                sub(location, 'recipe', recipe)
+
+        summary = sub(version, 'Summary')
+        add_namespaces(summary)
+        statements = sub(summary, 'Statements')
+        statements.set('fingerprint', f'{i:064x}:1:exact')
+        for part in ('Subjects', 'Predicates'):
+            part_elem = sub(statements, part)
+            sub(part_elem, 'count', 1000 + i)
+            add_namespaces(part_elem)
+        objects = sub(statements, 'Objects')
+        sub(objects, 'count', 2000 + i)
+        add_namespaces(objects)
+        for part in ('Classes', 'Literals'):
+            part_elem = sub(objects, part)
+            sub(part_elem, 'count', 300 + i)
+            if part == 'Literals':
+                languages = sub(part_elem, 'Languages')
+                for lang in ('en', 'nl', 'de'):
+                    language = sub(languages, 'Language')
+                    sub(language, 'code', lang)
+                    sub(language, 'count', i)
+            add_namespaces(part_elem)
+            add_namespace_items(part_elem)
+
+    review = sub(vocabulary, 'Review')
+    sub(review, 'status', 'published')
+    sub(review, 'author', 'Benchmark')
+    sub(review, 'published', '2021-02-03T10:00:00')
+    sub(review, 'body', 'A review')
+    sub(review, 'rating', 4)
+
+    return root
+
+
+def benchmark(paths: List[str], repeat: int = 3) -> None:
+    records = [(path, read_xml(open(path, 'rb').read())) for path in paths] or \
+              [('synthetic record', create_benchmark_record())]
+
+    for name, root in records:
+        print(f'{name}: {len(write_xml(root))} bytes, {len(xpath_select(xpath_version, root))} versions')
+        for i in range(repeat):
+            start = time.perf_counter()
+            expected = parse_record(0, root, select=lambda path, elem: elementpath.select(elem, path, ns),
+                                    first=grab_first, value=grab_value)
+            elementpath_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            record = parse_record(0, root)
+            compiled_time = time.perf_counter() - start
+
+            print(f'Run {i + 1}: elementpath {elementpath_time:.3f}s, compiled {compiled_time:.3f}s '
+                  f'({elementpath_time / compiled_time:.1f}x), identical: {record == expected}')
+
+
+if __name__ == '__main__':
+    benchmark(sys.argv[1:])
@@ -1,5 +1,8 @@
+import pickle
+import hashlib
 import logging
 from contextlib import contextmanager
+from contextvars import ContextVar
 
 import elementpath
 
@@ -7,11 +10,13 @@ from lxml import etree
 from lxml.etree import Element
 from datetime import datetime
 from pydantic import BaseModel
-from typing import Optional, List, Generator, Tuple, Any
+from typing import Optional, List, Generator, Tuple, Any, Callable
 
 from vocab.util.fs import get_cached_version
-from vocab.util.redis import get_object_redis, store_object_redis
-from vocab.util.xml import ns, ns_prefix, voc_root, grab_value, grab_first, read_xml, write_xml
+from vocab.config import record_cache_ttl
+from vocab.util.redis import get_object_redis, update_object_redis, get_record_redis, store_record_redis
+from vocab.util.xml import ns, ns_prefix, voc_root, grab_value, grab_first, read_xml, write_xml, \
+    xpath_select, xpath_first, xpath_value
 
 log = logging.getLogger(__name__)
 
@@ -153,6 +158,8 @@ class SummaryObjectStats(SummaryStats):
 
 
 class Summary(BaseModel):
+    approximate: bool = False
+    fingerprint: Optional[str] = None
     stats: Optional[SummaryStats] = None
     subjects: Optional[SummaryStats] = None
     predicates: Optional[SummaryStats] = None
@@ -186,138 +193,223 @@ class Vocab(BaseModel):
     reviews: List[Review] = []
 
 
+# Fields of a record view that are parsed straight from the XML, without building the full record
+record_view_fields: dict[str, Callable[[Element], Any]] = {
+    'identifier': lambda root: xpath_value(xpath_identification_identifier, root),
+    'title': lambda root: xpath_value(xpath_identification_title, root),
+    'description': lambda root: xpath_value(xpath_description_description, root),
+    'type': lambda root: Type(
+        syntax=xpath_value(xpath_type_syntax, root),
+        kos=xpath_value(xpath_type_kos, root),
+        entity=xpath_value(xpath_type_entity, root)
+    ),
+    'topic': lambda root: Topic(
+        unesco=xpath_value(xpath_description_topic_unesco, root),
+        nwo=xpath_value(xpath_description_topic_nwo, root)
+    ) if xpath_first(xpath_description_topic_unesco, root) is not None or
+         xpath_first(xpath_description_topic_nwo, root) is not None else None,
+    'registries': lambda root: [Registry(
+        title=xpath_value(xpath_title, elem),
+        url=xpath_value(xpath_url, elem),
+        landing_page=xpath_value(xpath_landing_page, elem),
+    ) for elem in xpath_select(xpath_is_referenced_by_registries, root)],
+}
+
+
+class RecordView:
+    """
+    Read-only view on a record that parses a field on first access and keeps it.
+
+    The fields in `record_view_fields` are parsed from the XML; any other field is taken from the full `Vocab` model,
+    which is only built (or loaded from the record cache) when such a field is accessed.
+    """
+    __slots__ = ('nr', 'id', 'xml_bytes', 'root', 'record', *record_view_fields)
+
+    def __init__(self, nr: int, id: int, xml_bytes: bytes):
+        object.__setattr__(self, 'nr', nr)
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'xml_bytes', xml_bytes)
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for slots that are not set yet, or for fields of the full record
+        if name == 'root':
+            value = read_xml(self.xml_bytes)
+        elif name == 'record':
+            value = self.parse_record()
+        elif name in record_view_fields:
+            value = record_view_fields[name](self.root)
+        elif name in Vocab.model_fields:
+            return getattr(self.record, name)
+        else:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+        object.__setattr__(self, name, value)
+        return value
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f'Record view of record nr {self.nr} is read-only')
+
+    def parse_record(self) -> Vocab:
+        # The parsed record is cached together with the hash of the XML it was parsed from
+        digest = hashlib.sha256(self.xml_bytes).digest()
+        if record_cache_ttl:
+            cached = get_record_redis(self.nr, self.id)
+            if cached is not None and cached[:len(digest)] == digest:
+                return pickle.loads(cached[len(digest):])
+
+        record = parse_record(self.nr, self.root)
+
+        if record_cache_ttl:
+            store_record_redis(self.nr, self.id, digest + pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL),
+                               record_cache_ttl)
+
+        return record
+
+
+def get_record_view(nr: int, id: int) -> RecordView:
+    return RecordView(nr, id, get_object_redis(nr, id))
+
+
 def get_record(nr: int, id: int) -> Vocab:
+    return get_record_view(nr, id).record
+
+
+def parse_record(nr: int, root: Element, select: Callable = xpath_select, first: Callable = xpath_first,
+                 value: Callable = xpath_value) -> Vocab:
+    # The selection functions can be replaced, so the compiled XPath expressions can be compared with elementpath
     def create_authority_for(elem: Element) -> Authority:
         return Authority(
-            uri=grab_value(xpath_uri, elem),
-            label=grab_value(xpath_label, elem),
+            uri=value(xpath_uri, elem),
+            label=value(xpath_label, elem),
         )
 
     def create_relaxing_authority_for(elem: Element) -> Authority:
         return Authority(
-            uri=grab_value(xpath_uri, elem),
-            label=grab_value(xpath_label, elem),
+            uri=value(xpath_uri, elem),
+            label=value(xpath_label, elem),
         )
 
     def create_registry_for(elem: Element) -> Registry:
         return Registry(
-            title=grab_value(xpath_title, elem),
-            url=grab_value(xpath_url, elem),
-            landing_page=grab_value(xpath_landing_page, elem),
+            title=value(xpath_title, elem),
+            url=value(xpath_url, elem),
+            landing_page=value(xpath_landing_page, elem),
         )
 
     def create_summary_for(elem: Element) -> SummaryStats:
         return SummaryStats(
-            count=grab_value(xpath_count, elem, int),
+            count=value(xpath_count, elem, int),
             stats=[SummaryNamespaceStats(
-                uri=grab_value(xpath_URI, ns_elem),
-                prefix=grab_value(xpath_prefix, ns_elem),
-                count=grab_value(xpath_count, ns_elem, int),
-            ) for ns_elem in elementpath.select(elem, xpath_namespace, ns)]
+                uri=value(xpath_URI, ns_elem),
+                prefix=value(xpath_prefix, ns_elem),
+                count=value(xpath_count, ns_elem, int),
+            ) for ns_elem in select(xpath_namespace, elem)]
         )
 
     def create_list_for(elem: Element) -> List[SummaryNamespaceNameStats]:
         return [SummaryNamespaceNameStats(
-            uri=grab_value(xpath_URI, list_item_elem),
-            prefix=grab_value(xpath_prefix, list_item_elem),
-            name=grab_value(xpath_name, list_item_elem),
-            count=grab_value(xpath_count, list_item_elem, int),
-        ) for list_item_elem in elementpath.select(elem, xpath_namespace_item, ns)]
+            uri=value(xpath_URI, list_item_elem),
+            prefix=value(xpath_prefix, list_item_elem),
+            name=value(xpath_name, list_item_elem),
+            count=value(xpath_count, list_item_elem, int),
+        ) for list_item_elem in select(xpath_namespace_item, elem)]
 
     def create_location_for(elem: Element) -> Location:
         return Location(
-            location=grab_value(xpath_uri, elem),
-            type=grab_value(xpath_type, elem),
-            recipe=grab_value(xpath_recipe, elem),
+            location=value(xpath_uri, elem),
+            type=value(xpath_type, elem),
+            recipe=value(xpath_recipe, elem),
         )
 
     def create_version(elem: Element) -> Version:
+        statements = first(xpath_summary_st, elem)
+        classes = first(xpath_summary_st_obj_classes, elem) if statements is not None else None
+        literals = first(xpath_summary_st_obj_literals, elem) if statements is not None else None
         summary = Summary(
-            stats=create_summary_for(grab_first(xpath_summary, elem)),
-            subjects=create_summary_for(grab_first(xpath_summary_st_subj, elem)),
-            predicates=create_summary_for(grab_first(xpath_summary_st_pred, elem)),
+            approximate=statements.get('approximate') == 'true',
+            fingerprint=statements.get('fingerprint'),
+            stats=create_summary_for(first(xpath_summary, elem)),
+            subjects=create_summary_for(first(xpath_summary_st_subj, elem)),
+            predicates=create_summary_for(first(xpath_summary_st_pred, elem)),
             objects=SummaryObjectStats(
-                **create_summary_for(grab_first(xpath_summary_st_obj, elem)).model_dump(),
+                **create_summary_for(first(xpath_summary_st_obj, elem)).model_dump(),
                 classes=SummaryListStats(
-                    **create_summary_for(grab_first(xpath_summary_st_obj_classes, elem)).model_dump(),
-                    list=create_list_for(grab_first(xpath_summary_st_obj_classes, elem)),
+                    **create_summary_for(classes).model_dump(),
+                    list=create_list_for(classes),
                 ),
                 literals=SummaryListLanguageStats(
-                    **create_summary_for(grab_first(xpath_summary_st_obj_literals, elem)).model_dump(),
-                    list=create_list_for(grab_first(xpath_summary_st_obj_literals, elem)),
+                    **create_summary_for(literals).model_dump(),
+                    list=create_list_for(literals),
                     languages={
-                        grab_value(xpath_code, lang_elem): grab_value(xpath_count, lang_elem, int)
-                        for lang_elem in elementpath.select(elem, xpath_summary_st_obj_literals_lang, ns)
+                        value(xpath_code, lang_elem): value(xpath_count, lang_elem, int)
+                        for lang_elem in select(xpath_summary_st_obj_literals_lang, elem)
                     },
                 ),
             )
-        ) if grab_first(xpath_summary_st, elem) is not None else None
+        ) if statements is not None else None
 
         return Version(
-            version=grab_value(xpath_version_no, elem),
-            validFrom=grab_value(xpath_valid_from, elem),
+            version=value(xpath_version_no, elem),
+            validFrom=value(xpath_valid_from, elem),
             locations=[create_location_for(loc_elem)
-                       for loc_elem in elementpath.select(elem, xpath_location, ns)],
+                       for loc_elem in select(xpath_location, elem)],
             summary=summary
         )
 
     def create_review_for(id: int, elem: Element) -> Review:
         return Review(
             id=id,
-            status=grab_value(xpath_status, elem),
-            author=grab_value(xpath_author, elem),
-            published=grab_value(xpath_published, elem),
-            body=grab_value(xpath_body, elem),
-            rating=grab_value(xpath_rating, elem),
-            likes=[grab_value('.', elem)
-                   for elem in elementpath.select(root, xpath_like, ns)],
-            dislikes=[grab_value('.', elem)
-                      for elem in elementpath.select(root, xpath_dislike, ns)],
+            status=value(xpath_status, elem),
+            author=value(xpath_author, elem),
+            published=value(xpath_published, elem),
+            body=value(xpath_body, elem),
+            rating=value(xpath_rating, elem),
+            likes=[value('.', elem)
+                   for elem in select(xpath_like, root)],
+            dislikes=[value('.', elem)
+                      for elem in select(xpath_dislike, root)],
         )
 
-    xml_bytes = get_object_redis(nr, id)
-    root = read_xml(xml_bytes)
-
     try:
         record = Vocab(
-            identifier=grab_value(xpath_identification_identifier, root),
-            title=grab_value(xpath_identification_title, root),
+            identifier=value(xpath_identification_identifier, root),
+            title=value(xpath_identification_title, root),
             namespace=Namespace(
-                uri=grab_value(xpath_uri, grab_first(xpath_identification_namespace, root)),
-                prefix=grab_value(xpath_prefix, grab_first(xpath_identification_namespace, root))
-            ) if grab_first(xpath_identification_namespace, root) is not None else None,
+                uri=value(xpath_uri, first(xpath_identification_namespace, root)),
+                prefix=value(xpath_prefix, first(xpath_identification_namespace, root))
+            ) if first(xpath_identification_namespace, root) is not None else None,
             creators=[create_authority_for(elem)
-                      for elem in elementpath.select(root, xpath_responsibility_creators, ns)],
+                      for elem in select(xpath_responsibility_creators, root)],
             maintainers=[create_authority_for(elem)
-                         for elem in elementpath.select(root, xpath_responsibility_maintainers, ns)],
+                         for elem in select(xpath_responsibility_maintainers, root)],
             contributors=[create_authority_for(elem)
-                          for elem in elementpath.select(root, xpath_responsibility_contributors, ns)],
-            description=grab_value(xpath_description_description, root),
-            date_issued=grab_value(xpath_description_date_issued, root),
-            languages=[grab_value('.', elem)
-                       for elem in elementpath.select(root, xpath_description_languages, ns)],
+                          for elem in select(xpath_responsibility_contributors, root)],
+            description=value(xpath_description_description, root),
+            date_issued=value(xpath_description_date_issued, root),
+            languages=[value('.', elem)
+                       for elem in select(xpath_description_languages, root)],
             topic=Topic(
-                unesco=grab_value(xpath_description_topic_unesco, root),
-                nwo=grab_value(xpath_description_topic_nwo, root)
-            ) if grab_first(xpath_description_topic_unesco, root) is not None or
-                 grab_first(xpath_description_topic_nwo, root) is not None else None,
+                unesco=value(xpath_description_topic_unesco, root),
+                nwo=value(xpath_description_topic_nwo, root)
+            ) if first(xpath_description_topic_unesco, root) is not None or
+                 first(xpath_description_topic_nwo, root) is not None else None,
             keywords=[create_relaxing_authority_for(elem)
-                      for elem in elementpath.select(root, xpath_description_keywords, ns)],
+                      for elem in select(xpath_description_keywords, root)],
             type=Type(
-                syntax=grab_value(xpath_type_syntax, root),
-                kos=grab_value(xpath_type_kos, root),
-                entity=grab_value(xpath_type_entity, root)
+                syntax=value(xpath_type_syntax, root),
+                kos=value(xpath_type_kos, root),
+                entity=value(xpath_type_entity, root)
             ),
             licenses=[create_relaxing_authority_for(elem)
-                      for elem in elementpath.select(root, xpath_licenses, ns)],
+                      for elem in select(xpath_licenses, root)],
             registries=[create_registry_for(elem)
-                        for elem in elementpath.select(root, xpath_is_referenced_by_registries, ns)],
+                        for elem in select(xpath_is_referenced_by_registries, root)],
             locations=[create_location_for(elem)
-                       for elem in elementpath.select(root, xpath_locations, ns)],
-            versions=sorted([create_version(elem) for elem in elementpath.select(root, xpath_version, ns)],
+                       for elem in select(xpath_locations, root)],
+            versions=sorted([create_version(elem) for elem in select(xpath_version, root)],
                             key=lambda x: (x.validFrom is not None, x.version), reverse=True),
             reviews=[create_review_for(i + 1, elem)
-                     for i, elem in enumerate(elementpath.select(root, xpath_review, ns))]
+                     for i, elem in enumerate(select(xpath_review, root))]
         )
     except Exception as e:
         log.error(f'Cannot parse record nr {nr}')
@@ -342,40 +434,85 @@ def with_version_and_dump(nr: int, id: int) -> Generator[Tuple[Vocab, Version, s
             yield record, version, cached_version_path
 
 
+# Mutations buffered per record by the write sessions that are active in the current context
+write_sessions: ContextVar[dict[Tuple[int, int], List[Callable[[Element], None]]]] = \
+    ContextVar('write_sessions', default={})
+
+
 @contextmanager
-def cmdi_from_redis(nr: int, id: int) -> Generator[etree.Element, None, None]:
-    xml_bytes = get_object_redis(nr, id)
-    xml = read_xml(xml_bytes)
+def write_session(nr: int, id: int) -> Generator[None, None, None]:
+    sessions = write_sessions.get()
+    if (nr, id) in sessions:
+        yield
+        return
+
+    mutations = []
+    token = write_sessions.set({**sessions, (nr, id): mutations})
+    try:
+        yield
+    finally:
+        write_sessions.reset(token)
+
+    flush_mutations(nr, id, mutations)
+
 
-    yield xml
+def mutate(nr: int, id: int, mutation: Callable[[Element], None]) -> None:
+    mutations = write_sessions.get().get((nr, id))
+    if mutations is not None:
+        mutations.append(mutation)
+    else:
+        flush_mutations(nr, id, [mutation])
+
+
+def flush_mutations(nr: int, id: int, mutations: List[Callable[[Element], None]]) -> bool:
+    if not mutations:
+        return False
+
+    def update(xml_bytes: bytes) -> bytes | None:
+        xml = read_xml(xml_bytes)
+        before = write_xml(xml)
+        for mutation in mutations:
+            mutation(xml)
+
+        after = write_xml(xml)
+        return after if after != before else None
 
-    xml_bytes = write_xml(xml)
-    store_object_redis(nr, id, xml_bytes)
+    changed = update_object_redis(nr, id, update)
+    log.debug(f'Flushed {len(mutations)} mutations of record {nr}:{id} ({"changed" if changed else "unchanged"})')
+
+    return changed
 
 
 def write_location(nr: int, id: int, version: str, uri: str, type: str, recipe: str | None) -> None:
-    with cmdi_from_redis(nr, id) as xml:
-        version_elem = grab_first(f"{voc_root}/cmd:Version/cmd:version[text()='{version}']/..", xml)
-        if version_elem is not None:
-            for location in elementpath.select(version_elem, "./cmd:Location", ns):
-                if grab_value("./cmd:recipe", location) == recipe:
-                    version_elem.remove(location)
+    write_locations(nr, id, [(version, uri, type, recipe)])
+
+
+def write_locations(nr: int, id: int, locations: List[Tuple[str, str, str, str | None]]) -> None:
+    def apply(xml: Element) -> None:
+        for version, uri, type, recipe in locations:
+            version_elem = grab_first(f"{voc_root}/cmd:Version/cmd:version[text()='{version}']/..", xml)
+            if version_elem is not None:
+                for location in elementpath.select(version_elem, "./cmd:Location", ns):
+                    if grab_value("./cmd:recipe", location) == recipe:
+                        version_elem.remove(location)
 
-            location = etree.SubElement(version_elem, f"{ns_prefix}Location", nsmap=ns)
+                location = etree.SubElement(version_elem, f"{ns_prefix}Location", nsmap=ns)
 
-            uri_elem = etree.SubElement(location, f"{ns_prefix}uri", nsmap=ns)
-            uri_elem.text = uri
+                uri_elem = etree.SubElement(location, f"{ns_prefix}uri", nsmap=ns)
+                uri_elem.text = uri
 
-            type_elem = etree.SubElement(location, f"{ns_prefix}type", nsmap=ns)
-            type_elem.text = type
+                type_elem = etree.SubElement(location, f"{ns_prefix}type", nsmap=ns)
+                type_elem.text = type
 
-            if recipe:
-                recipe_elem = etree.SubElement(location, f"{ns_prefix}recipe", nsmap=ns)
-                recipe_elem.text = recipe
+                if recipe:
+                    recipe_elem = etree.SubElement(location, f"{ns_prefix}recipe", nsmap=ns)
+                    recipe_elem.text = recipe
+
+    mutate(nr, id, apply)
 
 
 def write_registry(nr: int, id: int, title: str, url: str, landing_page: str | None) -> None:
-    with (cmdi_from_redis(nr, id) as xml):
+    def apply(xml: Element) -> None:
         is_referenced_by_elem = grab_first(f"{voc_root}/cmd:IsReferencedBy", xml)
         if is_referenced_by_elem is None:
             is_referenced_by_elem = etree.SubElement(grab_first(f"{voc_root}", xml), f"{ns_prefix}IsReferencedBy",
@@ -396,3 +533,5 @@ def write_registry(nr: int, id: int, title: str, url: str, landing_page: str | N
         if landing_page is not None:
             landing_page_elem = etree.SubElement(registry, f"{ns_prefix}landingPage", nsmap=ns)
             landing_page_elem.text = landing_page
+
+    mutate(nr, id, apply)
@@ -8,6 +8,10 @@ editor_uri = os.environ.get('EDITOR_URI', 'http://localhost:1210')
 redis_uri = os.environ.get('REDIS_URI', 'redis://localhost/0')
 log_level = os.environ.get('LOG_LEVEL', 'INFO')
 concurrency = os.environ.get('CONCURRENCY', 10)
+record_cache_ttl = int(os.environ.get('RECORD_CACHE_TTL', 86400))
+work_item_ttl = int(os.environ.get('WORK_ITEM_TTL', 604800))
+work_item_compress_threshold = int(os.environ.get('WORK_ITEM_COMPRESS_THRESHOLD', 4096))
+work_item_orphan_age = int(os.environ.get('WORK_ITEM_ORPHAN_AGE', 86400))
 
 elasticsearch_uri = os.environ.get('ES_URI', 'http://localhost:9200')
 elasticsearch_index = os.environ.get('ES_INDEX', 'vocab')
@@ -18,6 +22,16 @@ sparql_url = os.environ.get('SPARQL_URL', 'https://localhost:5000')
 sparql_update_url = os.environ.get('SPARQL_UPDATE_URL', 'https://localhost:5000')
 sparql_user = os.environ.get('SPARQL_USER')
 sparql_password = os.environ.get('SPARQL_PASSWORD')
+sparql_graph_store_url = os.environ.get('SPARQL_GRAPH_STORE_URL', sparql_update_url)
+sparql_load_chunk_size = int(os.environ.get('SPARQL_LOAD_CHUNK_SIZE', 50_000))
+sparql_pool_size = int(os.environ.get('SPARQL_POOL_SIZE', 10))
+sparql_connect_timeout = float(os.environ.get('SPARQL_CONNECT_TIMEOUT', 10))
+sparql_read_timeout = float(os.environ.get('SPARQL_READ_TIMEOUT', 300))
+sparql_retries = int(os.environ.get('SPARQL_RETRIES', 5))
+sparql_gzip = os.environ.get('SPARQL_GZIP', 'false').lower() == 'true'
+sparql_load_workers = int(os.environ.get('SPARQL_LOAD_WORKERS', 4))
+sparql_load_queue_size = int(os.environ.get('SPARQL_LOAD_QUEUE_SIZE', 8))
+sparql_graph_cache_ttl = int(os.environ.get('SPARQL_GRAPH_CACHE_TTL', 300))
 
 vocab_registry_url = os.environ.get('VOCAB_REGISTRY_URL', 'https://localhost:5000')
 vocab_static_url = os.environ.get('VOCAB_STATIC_URL', 'https://localhost:5000')
@@ -28,3 +42,13 @@ root_path = os.environ.get('ROOT_PATH', './data')
 jsonld_rel_path = os.environ.get('JSONLD_REL_PATH', 'jsonld')
 docs_rel_path = os.environ.get('DOCS_REL_PATH', 'docs')
 cache_rel_path = os.environ.get('CACHE_REL_PATH', 'cache')
+cache_revalidate = os.environ.get('CACHE_REVALIDATE', 'false').lower() == 'true'
+cache_concurrency = int(os.environ.get('CACHE_CONCURRENCY', 8))
+cache_host_concurrency = int(os.environ.get('CACHE_HOST_CONCURRENCY', 2))
+
+summarizer_streaming = os.environ.get('SUMMARIZER_STREAMING', 'true').lower() == 'true'
+summarizer_approximate_threshold = int(os.environ.get('SUMMARIZER_APPROXIMATE_THRESHOLD', 0))
+summarizer_hll_precision = int(os.environ.get('SUMMARIZER_HLL_PRECISION', 14))
+
+graph_cache_size = int(os.environ.get('GRAPH_CACHE_SIZE', 0))
+graph_cache_disk_size = int(os.environ.get('GRAPH_CACHE_DISK_SIZE', 4096))
@@ -2,22 +2,35 @@ import os
 import re
 import sys
 import bz2
+import zlib
 import gzip
 import logging
+import hashlib
+import tempfile
 import requests
+import threading
 
-from io import BytesIO
 from zipfile import ZipFile
+from urllib.parse import urlparse
+from rdflib.util import guess_format
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime, timezone
+from typing import Iterable, Generator, Callable, Tuple
 
 from vocab.app import celery
-from vocab.cmdi import with_version, write_location
-from vocab.config import root_path, cache_rel_path, vocab_static_url
-from vocab.util.fs import get_cached_version
-from vocab.util.rdf import content_type_extensions
+from vocab.cmdi import with_version, write_locations
+from vocab.config import root_path, cache_rel_path, cache_revalidate, cache_concurrency, cache_host_concurrency, \
+    vocab_static_url
+from vocab.util.fs import CacheMetadata, get_cached_version, get_cache_metadata, get_cache_metadata_path, \
+    write_cache_metadata, get_url_metadata, write_url_metadata, get_blob_path, link_file, add_to_cache_index
+from vocab.util.rdf import content_type_extensions, sniff_format, sniff_size
 from vocab.util.work import get_files_in_path, run_work_for_file
 
 log = logging.getLogger(__name__)
 
+chunk_size = 1024 * 1024
+spool_size = 64 * 1024 * 1024
+
 
 def get_relative_path_for_file(id: str, version: str, extension: str) -> str:
     return os.path.join(id, version + extension)
@@ -26,79 +39,236 @@ def get_relative_path_for_file(id: str, version: str, extension: str) -> str:
 @celery.task(name='cache', autoretry_for=(Exception,), retry_backoff=5,
              default_retry_delay=60 * 30, retry_kwargs={'max_retries': 10})
 def cache_files(nr: int, id: int) -> None:
-    for record, version in with_version(nr, id):
-        for location in version.locations:
-            if location.type == 'dump':
-                cached_path = get_cached_version(record.identifier, version.version)
+    host_semaphores = {}
+    host_semaphores_lock = threading.Lock()
+
+    def cache_for_host(url: str, identifier: str, version: str, cached_path: str | None,
+                       download: Future | None) -> str | None:
+        # Wait for another version with the same URL, so the content is only downloaded once
+        if download is not None:
+            download.result()
+
+        host = urlparse(url).netloc
+        with host_semaphores_lock:
+            if host not in host_semaphores:
+                host_semaphores[host] = threading.BoundedSemaphore(cache_host_concurrency)
+
+        with host_semaphores[host]:
+            try:
                 if cached_path is None:
-                    try:
-                        log.info(f"No cache found for {record.identifier}: {location.location}, creating!")
-                        cache_for_file(nr, id, location.location, record.identifier, version.version)
-                    except Exception as e:
-                        log.error(f'Failed to cache for {record.identifier}: {location.location}: {e}')
+                    log.info(f"No cache found for {identifier}: {url}, creating!")
                 else:
-                    log.info(f"Write cache location for {record.identifier} and version {version.version}")
-                    write_cache_location(nr, id, record.identifier, version.version, cached_path)
+                    log.info(f"Revalidate cache for {identifier}: {url}")
+                if download is None:
+                    return cache_for_file(url, identifier, version, cached_path)
 
+                # The other version just (re)validated the URL, so its metadata is newer than the own metadata
+                return cache_for_file(url, identifier, version, cached_path, False, get_url_metadata(url))
+            except Exception as e:
+                log.error(f'Failed to cache for {identifier}: {url}: {e}')
+                return None
 
-def cache_for_file(nr: int, id: int, url: str, identifier: str, version: str) -> None:
-    response = requests.get(url, allow_redirects=True)
-    if response.ok:
-        url_hash = ''
-        if '#' in url:
-            url, url_hash = url[0:url.index('#')], url[url.index('#') + 1:]
+    locations = []
+    downloads = {}
+    with ThreadPoolExecutor(max_workers=cache_concurrency) as executor:
+        for record, version in with_version(nr, id):
+            for location in version.locations:
+                if location.type == 'dump':
+                    cached_path = get_cached_version(record.identifier, version.version)
+                    if cached_path is None or cache_revalidate:
+                        future = executor.submit(cache_for_host, location.location, record.identifier,
+                                                 version.version, cached_path, downloads.get(location.location))
+                        downloads.setdefault(location.location, future)
+                        locations.append((version.version, future))
+                    else:
+                        log.info(f"Write cache location for {record.identifier} and version {version.version}")
+                        locations.append((version.version,
+                                          get_cache_uri(record.identifier, version.version, cached_path)))
 
-        content_disposition = response.headers.get('content-disposition', '')
-        file_name_regex = re.findall('filename=(.+)', content_disposition)
-        file_name = file_name_regex[0] if file_name_regex else url
+    locations = [(version, uri.result() if isinstance(uri, Future) else uri) for version, uri in locations]
+    write_locations(nr, id, [(version, uri, 'dump', 'cache') for version, uri in locations if uri is not None])
 
-        file_name, file_extension = os.path.splitext(file_name)
-        content = response.content
 
-        if file_extension == '.zip' and url_hash:
-            file_name, file_extension = os.path.splitext(url_hash)
-            with ZipFile(BytesIO(content)) as zip, zip.open(url_hash) as file:
-                content = file.read()
+def cache_for_file(url: str, identifier: str, version: str, cached_path: str = None,
+                   revalidate: bool = cache_revalidate, metadata: CacheMetadata | None = None) -> str | None:
+    if metadata is None:
+        metadata = get_cache_metadata(cached_path) if cached_path is not None else get_url_metadata(url)
+    if metadata is not None and metadata.url != url:
+        metadata = None
+    if metadata is not None and cached_path is None and not os.path.exists(get_blob_path(metadata.hash)):
+        metadata = None
+    if metadata is not None and metadata.extension is None:
+        metadata.extension = os.path.splitext(cached_path[:-3])[1]
 
-        if file_extension == '.bz2':
-            file_name, file_extension = os.path.splitext(file_name)
-            content = bz2.decompress(content)
+    if metadata is not None and not revalidate and os.path.exists(get_blob_path(metadata.hash)):
+        log.info(f"Cache found for {url}, reuse for {identifier} and version {version}!")
+        return link_cached_file(identifier, version, metadata, cached_path)
+
+    headers = {}
+    if metadata is not None and metadata.etag:
+        headers['If-None-Match'] = metadata.etag
+    if metadata is not None and metadata.last_modified:
+        headers['If-Modified-Since'] = metadata.last_modified
+
+    with requests.get(url, headers=headers, allow_redirects=True, stream=True) as response:
+        if response.status_code == requests.codes.not_modified and metadata is not None:
+            metadata.checked = datetime.now(timezone.utc)
+
+            log.info(f"Cache not modified for {identifier} and version {version}!")
+            return link_cached_file(identifier, version, metadata, cached_path)
+        elif response.ok:
+            source_url, url_hash = url, ''
+            if '#' in url:
+                url, url_hash = url[0:url.index('#')], url[url.index('#') + 1:]
+
+            content_disposition = response.headers.get('content-disposition', '')
+            file_name_regex = re.findall('filename=(.+)', content_disposition)
+            file_name = file_name_regex[0] if file_name_regex else url
 
-        if file_extension == '.gz':
             file_name, file_extension = os.path.splitext(file_name)
-        else:
-            content = gzip.compress(content)
+            chunks = response.iter_content(chunk_size=chunk_size)
 
-        content_type = response.headers.get('content-type')
-        if content_type:
-            content_type = content_type.split(';')[0]
+            if file_extension == '.zip' and url_hash:
+                file_name, file_extension = os.path.splitext(url_hash)
+                chunks = read_zip_member(chunks, url_hash)
+
+            if file_extension == '.bz2':
+                file_name, file_extension = os.path.splitext(file_name)
+                chunks = decompress(chunks, bz2.BZ2Decompressor)
+
+            if file_extension == '.gz':
+                file_name, file_extension = os.path.splitext(file_name)
+                chunks = decompress(chunks, lambda: zlib.decompressobj(wbits=zlib.MAX_WBITS | 16))
+
+            content_type = response.headers.get('content-type')
+            if content_type:
+                content_type = content_type.split(';')[0]
+
+            if not file_extension and content_type:
+                if content_type in content_type_extensions:
+                    file_extension = content_type_extensions[content_type]
+                else:
+                    log.warning(f"No file extension, but we have a content type for {identifier}: {content_type}!")
+
+            if file_extension:
+                content_hash, content_length = write_blob(chunks)
+                unchanged = metadata is not None and metadata.hash == content_hash
+
+                with gzip.open(get_blob_path(content_hash), 'r') as content:
+                    content_format = sniff_format(content.read(sniff_size), guess_format(file_extension))
+
+                now = datetime.now(timezone.utc)
+                metadata = CacheMetadata(
+                    url=source_url,
+                    etag=response.headers.get('etag'),
+                    last_modified=response.headers.get('last-modified'),
+                    content_length=content_length,
+                    hash=content_hash,
+                    extension=file_extension,
+                    format=content_format,
+                    modified=metadata.modified if unchanged else now,
+                    checked=now,
+                )
+
+                if unchanged:
+                    log.info(f"Cache unchanged for {identifier} and version {version}!")
+                else:
+                    log.info(f"Cache created for {identifier} and version {version}!")
 
-        if not file_extension and content_type:
-            if content_type in content_type_extensions:
-                file_extension = content_type_extensions[content_type]
+                return link_cached_file(identifier, version, metadata, cached_path)
             else:
-                log.warning(f"No file extension, but we have a content type for {identifier}: {content_type}!")
+                log.error(f"No file extension found for {identifier} and version {version}!")
+        else:
+            log.error(f"Failed to create cache for {identifier} and version {version}!")
+
+    return None
+
+
+def link_cached_file(identifier: str, version: str, metadata: CacheMetadata, cached_path: str | None) -> str:
+    cached_file_name = os.path.join(root_path, cache_rel_path,
+                                    get_relative_path_for_file(identifier, version, metadata.extension) + '.gz')
+
+    # Move cached files from before the introduction of the blob store into the store
+    blob_path = get_blob_path(metadata.hash)
+    if not os.path.exists(blob_path) and cached_path is not None:
+        link_file(cached_path, blob_path)
+
+    link_file(blob_path, cached_file_name)
+    write_cache_metadata(cached_file_name, metadata)
+    write_url_metadata(metadata)
+    add_to_cache_index(identifier, version, cached_file_name, metadata)
+
+    if cached_path is not None and cached_path != cached_file_name:
+        remove_cached_file(cached_path)
+
+    return get_cache_uri(identifier, version, cached_file_name)
+
+
+def read_zip_member(chunks: Iterable[bytes], member: str) -> Generator[bytes, None, None]:
+    # Zip files keep their index at the end, so the archive is spooled to disk first
+    with tempfile.SpooledTemporaryFile(max_size=spool_size) as spool:
+        for chunk in chunks:
+            spool.write(chunk)
 
-        if file_extension:
-            cached_file_name = os.path.join(root_path, cache_rel_path,
-                                            get_relative_path_for_file(identifier, version, file_extension) + '.gz')
-            os.makedirs(os.path.dirname(cached_file_name), exist_ok=True)
-            open(cached_file_name, 'wb').write(content)
+        spool.seek(0)
+        with ZipFile(spool) as zip, zip.open(member) as file:
+            while chunk := file.read(chunk_size):
+                yield chunk
 
-            uri = f'{vocab_static_url}/cache/{get_relative_path_for_file(identifier, version, file_extension)}'
-            write_location(nr, id, version, uri, 'dump', 'cache')
 
-            log.info(f"Cache created for {identifier} and version {version}!")
+def decompress(chunks: Iterable[bytes], create_decompressor: Callable) -> Generator[bytes, None, None]:
+    decompressor = create_decompressor()
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+
+            # Concatenated streams are valid for both bzip2 and gzip, so start over with the remainder
+            chunk = b''
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor = create_decompressor()
+
+
+def write_blob(chunks: Iterable[bytes]) -> Tuple[str, int]:
+    folder = os.path.join(root_path, cache_rel_path, '.blobs')
+    os.makedirs(folder, exist_ok=True)
+
+    content_hash = hashlib.sha256()
+    content_length = 0
+
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file, gzip.GzipFile(fileobj=tmp_file, mode='wb') as gzip_file:
+            for chunk in chunks:
+                content_hash.update(chunk)
+                content_length += len(chunk)
+                gzip_file.write(chunk)
+
+        blob_path = get_blob_path(content_hash.hexdigest())
+        if os.path.exists(blob_path):
+            os.remove(tmp_path)
         else:
-            log.error(f"No file extension found for {identifier} and version {version}!")
-    else:
-        log.error(f"Failed to create cache for {identifier} and version {version}!")
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(tmp_path, blob_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return content_hash.hexdigest(), content_length
 
 
-def write_cache_location(nr: int, id: int, identifier: str, version: str, cached_path: str) -> None:
+def get_cache_uri(identifier: str, version: str, cached_path: str) -> str:
     file_name, file_extension = os.path.splitext(cached_path[:-3])
-    uri = f'{vocab_static_url}/cache/{get_relative_path_for_file(identifier, version, file_extension)}'
-    write_location(nr, id, version, uri, 'dump', 'cache')
+    return f'{vocab_static_url}/cache/{get_relative_path_for_file(identifier, version, file_extension)}'
+
+
+def remove_cached_file(cached_path: str) -> None:
+    for path in [cached_path, get_cache_metadata_path(cached_path)]:
+        if os.path.exists(path):
+            os.remove(path)
 
 
 if __name__ == '__main__':
@@ -3,14 +3,15 @@ import sys
 import gzip
 import logging
 
+from typing import List, Tuple
 from itertools import chain
 from pylode import OntPub, PylodeError
 from rdflib import OWL, RDF, URIRef, DCTERMS, Literal, PROF, SKOS, Graph
 
 from vocab.app import celery
-from vocab.cmdi import with_version_and_dump, write_location
+from vocab.cmdi import with_version_and_dump, write_locations
 from vocab.config import vocab_static_url, root_path, docs_rel_path
-from vocab.util.work import get_files_in_path, run_work_for_file
+from vocab.util.work import get_files_in_path, run_work_for_file, run_per_version
 from vocab.util.rdf import load_cached_into_graph
 
 log = logging.getLogger(__name__)
@@ -20,9 +21,10 @@ def get_relative_path_for_file(id: str, version: str, without_gz: bool = False)
     return os.path.join(id, version + '.html' + ('' if without_gz else '.gz'))
 
 
-@celery.task(name='rdf.documentation', autoretry_for=(Exception,),
+@celery.task(name='rdf.documentation', bind=True, autoretry_for=(Exception,),
              default_retry_delay=60 * 30, retry_kwargs={'max_retries': 5})
-def create_documentation(nr: int, id: int):
+def create_documentation(self, nr: int, id: int):
+    subtasks, existing = [], []
     for record, version, cached_version_path in with_version_and_dump(nr, id):
         if record.type.syntax in ['owl', 'skos']:
             path = os.path.join(root_path, docs_rel_path,
@@ -30,16 +32,32 @@ def create_documentation(nr: int, id: int):
             if not os.path.exists(path):
                 log.info(f"No documentation found for {record.identifier} with version {version.version}, creating!")
                 location = next((loc for loc in version.locations if loc.type == 'dump'), None)
-                create_documentation_for_file(nr, id, record.identifier, version.version, record.title,
-                                              location.location,
-                                              cached_version_path)
+                subtasks.append(create_documentation_for_version.s(record.identifier, version.version, record.title,
+                                                                   location.location, cached_version_path))
             else:
                 log.info(f"Write documentation location for {record.identifier} and version {version.version}")
-                write_docs_location(nr, id, record.identifier, version.version)
+                existing.append((record.identifier, version.version))
 
+    run_per_version(self, subtasks, write_docs_locations.s(nr, id, existing))
 
-def create_documentation_for_file(nr: int, id: int, identifier: str, version: str, title: str, uri: str,
-                                  cached_version_path: str) -> None:
+
+@celery.task(name='rdf.documentation.version')
+def create_documentation_for_version(identifier: str, version: str, title: str, uri: str,
+                                     cached_version_path: str) -> Tuple[str, str] | None:
+    if create_documentation_for_file(identifier, version, title, uri, cached_version_path):
+        return identifier, version
+    return None
+
+
+@celery.task(name='rdf.documentation.write')
+def write_docs_locations(results: List[Tuple[str, str] | None], nr: int, id: int,
+                         existing: List[Tuple[str, str]]) -> None:
+    write_locations(nr, id, [(version, get_docs_uri(identifier, version), 'homepage', 'doc')
+                             for identifier, version in existing + [result for result in results if result]])
+
+
+def create_documentation_for_file(identifier: str, version: str, title: str, uri: str,
+                                  cached_version_path: str) -> bool:
     try:
         graph = Graph()
         load_cached_into_graph(graph, cached_version_path)
@@ -69,9 +87,8 @@ def create_documentation_for_file(nr: int, id: int, identifier: str, version: st
         html = gzip.compress(bytes(html, 'utf-8'))
         open(doc_path, 'wb').write(html)
 
-        uri = vocab_static_url + '/docs/' + get_relative_path_for_file(identifier, version, without_gz=True)
-        write_location(nr, id, version, uri, 'homepage', 'doc')
         log.info(f'Produced documentation for {identifier} with version {version}!')
+        return True
     except Exception as e:
         if str(e) == "pyLODE can't detect a URI for an owl:Ontology, a skos:ConceptScheme or a prof:Profile":
             graph = Graph()
@@ -87,11 +104,11 @@ def create_documentation_for_file(nr: int, id: int, identifier: str, version: st
             open(doc_path, 'w').write(html)
         else:
             log.error(f'Doc error for {identifier} with version {version}: {e}')
+        return False
 
 
-def write_docs_location(nr: int, id: int, identifier: str, version: str) -> None:
-    uri = vocab_static_url + '/docs/' + get_relative_path_for_file(identifier, version, without_gz=True)
-    write_location(nr, id, version, uri, 'homepage', 'doc')
+def get_docs_uri(identifier: str, version: str) -> str:
+    return vocab_static_url + '/docs/' + get_relative_path_for_file(identifier, version, without_gz=True)
 
 
 if __name__ == '__main__':
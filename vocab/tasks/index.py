@@ -2,7 +2,7 @@ import sys
 import logging
 
 from vocab.app import celery
-from vocab.cmdi import get_record
+from vocab.cmdi import get_record_view
 from vocab.config import elasticsearch_index
 from vocab.util.elasticsearch import es
 from vocab.util.work import get_files_in_path, run_work_for_file
@@ -13,7 +13,7 @@ log = logging.getLogger(__name__)
 @celery.task(name='index', autoretry_for=(Exception,),
              default_retry_delay=60 * 30, retry_kwargs={'max_retries': 5})
 def index(nr: int, id: int) -> None:
-    record = get_record(nr, id)
+    record = get_record_view(nr, id)
     es.index(
         index=elasticsearch_index,
         id=nr,
@@ -12,7 +12,7 @@ from rdflib import Namespace, Graph, DCAT, DCTERMS, SDO, VOID, RDF, Literal, URI
 from vocab.app import celery
 from vocab.cmdi import get_record, Vocab, Version, Review
 from vocab.config import root_path, jsonld_rel_path, vocab_registry_url
-from vocab.util.rdf import get_sparql_store
+from vocab.util.rdf import sparql_client, encode_bnode_to_sparql
 from vocab.util.work import get_files_in_path, run_work_for_file
 
 VOCAB = Namespace(vocab_registry_url + '/vocab/')
@@ -57,12 +57,11 @@ PUBLISHER = {
              default_retry_delay=60 * 30, retry_kwargs={'max_retries': 5})
 def create_jsonld(nr: int, id: int) -> None:
     record = get_record(nr, id)
-    current_graph = get_current_jsonld(record.identifier)
 
     new_graph = init_graph()
     create_rdf_in_graph(record, new_graph)
 
-    replace_in_sparql_store(current_graph, new_graph)
+    replace_in_sparql_store(get_record_graph_uri(record.identifier), new_graph)
 
     jsonld_output = json.loads(new_graph.serialize(format='json-ld', context=CONTEXT))
     jsonld_framed = jsonld.frame(jsonld_output, FRAME)
@@ -74,16 +73,8 @@ def create_jsonld(nr: int, id: int) -> None:
     open(os.path.join(root_path, jsonld_rel_path, record.identifier + '.jsonld.gz'), 'wb').write(jsonld_data)
 
 
-def get_current_jsonld(id: str) -> Graph | None:
-    jsonld_file = os.path.join(root_path, jsonld_rel_path, id + '.json.gz')
-    if os.path.exists(jsonld_file):
-        graph = Graph(bind_namespaces='core')
-        with gzip.open(jsonld_file, 'r') as jsonld_data:
-            graph.parse(jsonld_data.read(), format='json-ld', context=CONTEXT)
-
-        return graph
-
-    return None
+def get_record_graph_uri(id: str) -> URIRef:
+    return URIRef(VOCAB[f'{id}/record'])
 
 
 def init_graph() -> Graph:
@@ -247,18 +238,13 @@ def create_version_summary_rdf_in_graph(cmdi: Vocab, version_uri: URIRef, versio
         graph.add((languages, VOID.triples, Literal(count)))
 
 
-def replace_in_sparql_store(old_graph: Graph | None, new_graph: Graph):
-    sparql_store = get_sparql_store(False)
-    graph = Graph(store=sparql_store)
-    nts = sparql_store.node_to_sparql
-
-    if old_graph:
-        for (s, p, o) in old_graph:
-            graph.update("DELETE { %s %s %s . } WHERE { %s %s %s . }" %
-                         (nts(s), nts(p), nts(o), nts(s), nts(p), nts(o)))
+def replace_in_sparql_store(graph_uri: URIRef, new_graph: Graph):
+    # Every record has its own named graph, which is dropped and filled again as a single update request
+    nts = encode_bnode_to_sparql
 
     sparql_add = ["%s %s %s ." % (nts(s), nts(p), nts(o)) for (s, p, o) in new_graph]
-    graph.update("INSERT DATA { %s }" % '\n'.join(sparql_add))
+    sparql_client.update("DROP SILENT GRAPH %s ;\nINSERT DATA { GRAPH %s { %s } }" %
+                         (nts(graph_uri), nts(graph_uri), '\n'.join(sparql_add)))
 
 
 if __name__ == '__main__':
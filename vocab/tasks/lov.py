@@ -3,11 +3,12 @@ import logging
 import requests
 
 from lxml import etree
+from lxml.etree import Element
 from typing import Optional
 from pydantic import BaseModel
 
 from vocab.app import celery
-from vocab.cmdi import get_record, cmdi_from_redis, write_registry
+from vocab.cmdi import get_record_view, mutate, write_session, write_registry
 from vocab.util.http import session
 from vocab.util.work import get_files_in_path, run_work_for_file
 from vocab.util.xml import grab_first, ns_prefix, ns, voc_root
@@ -24,23 +25,24 @@ class MinimumVocabInfoLOV(BaseModel):
 @celery.task(name='rdf.lov', autoretry_for=(Exception,),
              default_retry_delay=60 * 30, retry_kwargs={'max_retries': 5})
 def lov(nr: int, id: int) -> None:
-    record = get_record(nr, id)
+    record = get_record_view(nr, id)
     if record and record.type.syntax in ['owl', 'skos', 'rdfs']:
-        response = session.get(lov_api_url, params={'vocab': record.identifier})
-        if response.status_code == requests.codes.ok:
-            data = MinimumVocabInfoLOV.model_validate(response.json())
-            log.info(f'Work wit vocab {record.identifier} results: {data}')
+        with write_session(nr, id):
+            response = session.get(lov_api_url, params={'vocab': record.identifier})
+            if response.status_code == requests.codes.ok:
+                data = MinimumVocabInfoLOV.model_validate(response.json())
+                log.info(f'Work wit vocab {record.identifier} results: {data}')
 
-            write_registry(nr, id, "LOV", "https://lov.linkeddata.es",
-                           f"https://lov.linkeddata.es/dataset/lov/vocabs/{record.identifier}")
-            if data.nsp and data.prefix:
-                write_namespace(nr, id, data.nsp, data.prefix)
-        else:
-            log.info(f'No vocab {record.identifier} results!')
+                write_registry(nr, id, "LOV", "https://lov.linkeddata.es",
+                               f"https://lov.linkeddata.es/dataset/lov/vocabs/{record.identifier}")
+                if data.nsp and data.prefix:
+                    write_namespace(nr, id, data.nsp, data.prefix)
+            else:
+                log.info(f'No vocab {record.identifier} results!')
 
 
 def write_namespace(nr: int, id: int, uri: str, prefix: str) -> None:
-    with cmdi_from_redis(nr, id) as vocab:
+    def apply(vocab: Element) -> None:
         namespace = grab_first(f"{voc_root}/cmd:Identification/cmd:Namespace", vocab)
         if namespace is None:
             identification = grab_first("./cmd:Identification", vocab)
@@ -57,6 +59,8 @@ def write_namespace(nr: int, id: int, uri: str, prefix: str) -> None:
         uri_elem.text = uri
         prefix_elem.text = prefix
 
+    mutate(nr, id, apply)
+
 
 if __name__ == '__main__':
     for f in get_files_in_path(sys.argv[1]):
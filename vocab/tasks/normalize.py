@@ -0,0 +1,41 @@
+import os
+import sys
+import logging
+
+from rdflib import Graph
+
+from vocab.app import celery
+from vocab.cmdi import with_version_and_dump
+from vocab.util.work import get_files_in_path, run_work_for_file
+from vocab.util.rdf import load_cached_into_graph, get_canonical_path, write_canonical
+
+log = logging.getLogger(__name__)
+
+
+@celery.task(name='rdf.normalize', autoretry_for=(Exception,),
+             default_retry_delay=60 * 30, retry_kwargs={'max_retries': 5})
+def normalize(nr: int, id: int) -> None:
+    for record, version, cached_version_path in with_version_and_dump(nr, id):
+        if record.type.syntax in ['owl', 'skos', 'rdfs']:
+            try:
+                canonical_path = get_canonical_path(cached_version_path)
+                if canonical_path is None:
+                    log.warning(f"No cache metadata found for {record.identifier} with version {version.version}!")
+                elif not os.path.exists(canonical_path):
+                    log.info(f"No canonical N-Triples found for {record.identifier} "
+                             f"with version {version.version}, creating!")
+                    normalize_file(cached_version_path, canonical_path)
+            except Exception as e:
+                log.error(f'Failed to normalize for {record.identifier} and version {version.version}: {e}')
+
+
+def normalize_file(cached_version_path: str, canonical_path: str) -> None:
+    graph = Graph(bind_namespaces='core')
+    load_cached_into_graph(graph, cached_version_path)
+    write_canonical(graph, canonical_path)
+
+
+if __name__ == '__main__':
+    for f in get_files_in_path(sys.argv[1]):
+        with run_work_for_file(f) as (nr, id):
+            normalize(nr, id)
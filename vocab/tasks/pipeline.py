@@ -2,12 +2,13 @@ from celery import chain
 
 from vocab.app import celery
 from vocab.util.work import run_work_for_file, run_work_for_record
-from vocab.tasks import cache, documentation, sparql, summarizer, lov, skosmos, jsonld, index
+from vocab.tasks import cache, normalize, documentation, sparql, summarizer, lov, skosmos, jsonld, index
 
 
 def pipeline(nr: int, id: int):
     res = chain(
         cache.cache_files.si(nr, id),
+        normalize.normalize.si(nr, id),
         documentation.create_documentation.si(nr, id),
         sparql.load_into_sparql_store.si(nr, id),
         summarizer.summarizer.si(nr, id),
@@ -5,7 +5,7 @@ import logging
 from rdflib import Graph, Namespace, DC, VOID, RDF, Literal, URIRef
 
 from vocab.app import celery
-from vocab.cmdi import with_version, write_location
+from vocab.cmdi import with_version, write_location, write_session
 from vocab.config import root_path, vocab_registry_url, skosmos_url
 from vocab.util.lock import task_lock
 from vocab.util.work import get_files_in_path, run_work_for_file
@@ -18,10 +18,11 @@ SKOSMOS = Namespace('http://purl.org/net/skosmos#')
 
 @celery.task(name='rdf.skosmos')
 def add_to_skosmos_config(nr: int, id: int):
-    for record, version in with_version(nr, id):
-        if record.type.syntax == 'skos':
-            log.info(f'Create Skosmos config for {record.identifier} and version {version.version}')
-            update_skosmos_config_with(nr, id, record.identifier, version.version, record.title)
+    with write_session(nr, id):
+        for record, version in with_version(nr, id):
+            if record.type.syntax == 'skos':
+                log.info(f'Create Skosmos config for {record.identifier} and version {version.version}')
+                update_skosmos_config_with(nr, id, record.identifier, version.version, record.title)
 
 
 @task_lock(main_key="update_skosmos_config")
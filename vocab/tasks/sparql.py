@@ -2,42 +2,81 @@ import sys
 import logging
 import urllib.parse
 
-from rdflib import Graph, URIRef
+from typing import List, Tuple
 
 from vocab.app import celery
 from vocab.config import sparql_url, vocab_registry_url
-from vocab.cmdi import with_version_and_dump, write_location
-from vocab.util.work import get_files_in_path, run_work_for_file
-from vocab.util.rdf import get_sparql_store, load_cached_into_graph
+from vocab.cmdi import with_version_and_dump, write_locations
+from vocab.util.work import get_files_in_path, run_work_for_file, run_per_version
+from vocab.util.fs import get_cached_content_key
+from vocab.util.redis import get_graph_loaded_redis, store_graph_loaded_redis, get_graph_checkpoint_redis
+from vocab.util.rdf import get_graph_counts, load_cached_into_remote, load_changes_into_remote
 
 log = logging.getLogger(__name__)
 
 
-@celery.task(name='rdf.sparql', autoretry_for=(Exception,),
+@celery.task(name='rdf.sparql', bind=True, autoretry_for=(Exception,),
              default_retry_delay=60 * 30, retry_kwargs={'max_retries': 5})
-def load_into_sparql_store(nr: int, id: int) -> None:
-    for record, version, cached_version_path in with_version_and_dump(nr, id):
-        if record.type.syntax in ['owl', 'skos', 'rdfs']:
-            try:
-                load_into_sparql_store_for_file(nr, id, record.identifier, version.version, cached_version_path)
-            except Exception as e:
-                log.error(f'Failed to load data into SPARQL for {record.identifier} and version {version.version}: {e}')
+def load_into_sparql_store(self, nr: int, id: int) -> None:
+    versions = [(record.identifier, version.version, cached_version_path)
+                for record, version, cached_version_path in with_version_and_dump(nr, id)
+                if record.type.syntax in ['owl', 'skos', 'rdfs']]
+    counts = get_graph_counts([get_graph_uri(identifier, version) for identifier, version, _ in versions])
 
+    subtasks = []
+    for identifier, version, cached_version_path in versions:
+        graph_uri = get_graph_uri(identifier, version)
+        count = counts[graph_uri]
+        loaded_hash = get_graph_loaded_redis(graph_uri) if count else None
+        interrupted = get_graph_checkpoint_redis(graph_uri) is not None
+        if interrupted:
+            log.info(f"Loading into SPARQL store for {identifier} with version {version} was interrupted, resuming!")
+            subtasks.append(load_into_sparql_store_for_version.s(identifier, version, cached_version_path))
+        elif count and loaded_hash == get_cached_content_key(cached_version_path):
+            log.info(f"Found {count} triples in SPARQL store for {identifier} with version {version}, skipping!")
+        else:
+            subtasks.append(load_into_sparql_store_for_version.s(identifier, version, cached_version_path,
+                                                                 loaded_hash))
 
-def load_into_sparql_store_for_file(nr: int, id: int, identifier: str, version: str, cached_version_path: str) -> None:
-    graph_uri = URIRef(f'{vocab_registry_url}/vocab/{identifier}/version/{version}')
-    graph = Graph(store=get_sparql_store(True), identifier=graph_uri)
+    run_per_version(self, subtasks, write_sparql_locations.s(nr, id))
 
-    graph_exists = graph.query('ASK WHERE { ?s ?p ?o }')
-    if not graph_exists:
-        log.info(f"No data found in SPARQL store for {identifier} with version {version}, creating!")
-        load_cached_into_graph(graph, cached_version_path, True)
-        # load_cached_into_remote(str(graph_uri), cached_version_path)
 
-        uri = f'{sparql_url}?default-graph-uri={urllib.parse.quote(graph_uri)}'
-        write_location(nr, id, version, uri, 'endpoint', 'sparql')
+@celery.task(name='rdf.sparql.version')
+def load_into_sparql_store_for_version(identifier: str, version: str, cached_version_path: str,
+                                       loaded_hash: str | None = None) -> Tuple[str, str | None]:
+    try:
+        return version, load_into_sparql_store_for_file(identifier, version, cached_version_path, loaded_hash)
+    except Exception as e:
+        log.error(f'Failed to load data into SPARQL for {identifier} and version {version}: {e}')
+        return version, None
 
-        log.info(f"Data loaded in SPARQL store for {identifier} with version {version}!")
+
+@celery.task(name='rdf.sparql.write')
+def write_sparql_locations(results: List[Tuple[str, str | None]], nr: int, id: int) -> None:
+    write_locations(nr, id, [(version, uri, 'endpoint', 'sparql') for version, uri in results if uri is not None])
+
+
+def get_graph_uri(identifier: str, version: str) -> str:
+    return f'{vocab_registry_url}/vocab/{identifier}/version/{version}'
+
+
+def load_into_sparql_store_for_file(identifier: str, version: str, cached_version_path: str,
+                                    loaded_hash: str | None = None) -> str:
+    graph_uri = get_graph_uri(identifier, version)
+
+    if loaded_hash is not None:
+        log.info(f"Data changed in cache for {identifier} with version {version}, updating!")
+        if not load_changes_into_remote(graph_uri, cached_version_path, loaded_hash):
+            log.info(f"Cannot only update the changes for {identifier} with version {version}, reloading!")
+            load_cached_into_remote(graph_uri, cached_version_path)
+    else:
+        log.info(f"No completely loaded data found in SPARQL store for {identifier} with version {version}, loading!")
+        load_cached_into_remote(graph_uri, cached_version_path)
+
+    store_graph_loaded_redis(graph_uri, get_cached_content_key(cached_version_path))
+
+    log.info(f"Data loaded in SPARQL store for {identifier} with version {version}!")
+    return f'{sparql_url}?default-graph-uri={urllib.parse.quote(graph_uri)}'
 
 
 if __name__ == '__main__':
@@ -1,6 +1,10 @@
 import sys
 import logging
 
+from typing import Tuple, List
+from collections import Counter
+from xml.sax import SAXParseException
+
 from lxml import etree
 from lxml.etree import Element
 from pydantic import BaseModel
@@ -9,13 +13,20 @@ from rdflib.term import Node
 from rdflib import Graph, RDF, XSD, URIRef, Literal
 
 from vocab.app import celery
-from vocab.cmdi import with_version_and_dump, cmdi_from_redis
-from vocab.util.work import get_files_in_path, run_work_for_file
-from vocab.util.rdf import load_cached_into_graph
+from vocab.cmdi import with_version_and_dump, mutate
+from vocab.util.work import get_files_in_path, run_work_for_file, run_per_version
+from vocab.util.hll import HyperLogLog
+from vocab.config import summarizer_streaming, summarizer_approximate_threshold, summarizer_hll_precision
+from vocab.util.fs import get_cached_hash
+from vocab.util.rdf import load_cached_into_graph, create_streaming_graph
 from vocab.util.xml import ns, ns_prefix, voc_root, grab_first
+from vocab.util.qname import NamespaceResolver, split_iri
 
 log = logging.getLogger(__name__)
 
+# Increase whenever the summaries change for the same input, so that all existing summaries are recreated
+summarizer_algorithm_version = 3
+
 
 class ClassesSummary(BaseModel):
     count: int = 0
@@ -38,6 +49,8 @@ class ObjectsSummaryPart(SummaryPart):
 
 class Summary(BaseModel):
     total: int = 0
+    approximate: bool = False
+    fingerprint: str | None = None
     prefixes: dict[str, str] = {}
     stats: dict[str, int] = {}
     subjects: SummaryPart = SummaryPart()
@@ -45,75 +58,166 @@ class Summary(BaseModel):
     objects: ObjectsSummaryPart = ObjectsSummaryPart()
 
 
-@celery.task(name='rdf.summarizer', autoretry_for=(Exception,),
+@celery.task(name='rdf.summarizer', bind=True, autoretry_for=(Exception,),
              default_retry_delay=60 * 30, retry_kwargs={'max_retries': 5})
-def summarizer(nr: int, id: int) -> None:
+def summarizer(self, nr: int, id: int) -> None:
+    subtasks = []
     for record, version, cached_version_path in with_version_and_dump(nr, id):
         if record.type.syntax in ['owl', 'skos', 'rdfs']:
-            try:
-                summary = summarize(cached_version_path)
-                write_summary_statements(nr, id, version.version, summary)
-            except Exception as e:
-                log.error(f'Failed to summarize for {record.identifier} and version {version.version}: {e}')
+            fingerprint = get_fingerprint(cached_version_path)
+            if fingerprint is not None and version.summary is not None \
+                    and version.summary.fingerprint == fingerprint:
+                log.info(f'Summary for {record.identifier} and version {version.version} is up to date, skipping!')
+                continue
 
+            subtasks.append(summarize_version.s(record.identifier, version.version, cached_version_path, fingerprint))
 
-def summarize(path: str) -> Summary:
-    def count_for(instance: Node, summary_part: SummaryPart, distinct: set) -> None:
-        distinct.add(instance)
+    run_per_version(self, subtasks, write_summaries.s(nr, id))
 
-        if isinstance(instance, URIRef):
-            try:
-                prefix, namespace, name = graph.compute_qname(instance)
-                summary.stats[prefix] = summary.stats.get(prefix, 0) + 1
-                summary_part.stats[prefix] = summary_part.stats.get(prefix, 0) + 1
-            except:
-                pass
 
-    def classes_count_for(instance: URIRef, classes_summary: ClassesSummary) -> None:
-        classes_summary.count += 1
+@celery.task(name='rdf.summarizer.version')
+def summarize_version(identifier: str, version: str, cached_version_path: str,
+                      fingerprint: str | None = None) -> Tuple[str, dict | None]:
+    try:
+        summary = summarize(cached_version_path)
+        summary.fingerprint = fingerprint
+        return version, summary.model_dump()
+    except Exception as e:
+        log.error(f'Failed to summarize for {identifier} and version {version}: {e}')
+        return version, None
 
-        try:
-            prefix, namespace, name = graph.compute_qname(instance)
-            prefix_stats = classes_summary.stats.get(prefix, {})
-            prefix_stats[name] = prefix_stats.get(name, 0) + 1
-            classes_summary.stats[prefix] = prefix_stats
-        except:
-            pass
 
-    graph = Graph(bind_namespaces='core')
-    load_cached_into_graph(graph, path)
+@celery.task(name='rdf.summarizer.write')
+def write_summaries(results: List[Tuple[str, dict | None]], nr: int, id: int) -> None:
+    write_summary_statements(nr, id, [(version, Summary.model_validate(summary))
+                                      for version, summary in results if summary is not None])
+
 
-    summary = Summary(prefixes={prefix: str(namespace)
-                                for prefix, namespace in graph.namespaces()})
+def get_fingerprint(cached_version_path: str) -> str | None:
+    # The summary only has to be recreated if the cached content, the algorithm or the approximation settings changed
+    hash = get_cached_hash(cached_version_path)
+    if hash is None:
+        return None
 
-    distinct = {"subjects": set(), "predicates": set(), "objects": set()}
+    settings = f'hll-{summarizer_approximate_threshold}-{summarizer_hll_precision}' \
+        if summarizer_approximate_threshold else 'exact'
+    return f'{hash}:{summarizer_algorithm_version}:{settings}'
 
-    for s, p, o in graph:
+
+def summarize(path: str, streaming: bool = summarizer_streaming) -> Summary:
+    def summarize_triple(triple: Tuple[Node, Node, Node]) -> None:
+        s, p, o = triple
         summary.total += 1
 
-        count_for(s, summary.subjects, distinct["subjects"])
-        count_for(p, summary.predicates, distinct["predicates"])
-        count_for(o, summary.objects, distinct["objects"])
+        if summary.approximate:
+            for part, instance in (("subjects", s), ("predicates", p), ("objects", o)):
+                sketches[part].add(instance)
+                if isinstance(instance, URIRef):
+                    count_namespace_for(part, instance, 1)
+        else:
+            counts["subjects"][s] += 1
+            counts["predicates"][p] += 1
+            counts["objects"][o] += 1
+
+            if summarizer_approximate_threshold and summary.total > summarizer_approximate_threshold:
+                switch_to_approximate()
 
         if isinstance(o, URIRef) and p == RDF.type:
-            classes_count_for(o, summary.objects.classes)
+            counts["classes"][o] += 1
 
         if isinstance(o, Literal):
             datatype = o.datatype if o.datatype else RDF.langString if o.language else XSD.string
-            classes_count_for(datatype, summary.objects.literals)
+            counts["literals"][datatype] += 1
 
             if o.language:
                 summary.objects.literals.languages[o.language] = \
                     summary.objects.literals.languages.get(o.language, 0) + 1
 
-    summary.subjects.count = len(distinct["subjects"])
-    summary.predicates.count = len(distinct["predicates"])
-    summary.objects.count = len(distinct["objects"])
+    def count_namespace_for(part: str, instance: URIRef, count: int) -> None:
+        # Only the namespace part is kept, split the same way as the resolver splits; the first local name seen is
+        # kept as a sample, for declared namespaces that end inside the local name
+        split = split_iri(instance)
+        if split is not None:
+            namespace, name = split
+            namespace_counts[part][namespace] += count
+            namespace_samples.setdefault(namespace, name)
+
+    def switch_to_approximate() -> None:
+        log.info(f'More than {summarizer_approximate_threshold} statements in {path}, '
+                 f'switching to approximate counts (error {sketches["subjects"].error:.2%})')
+
+        summary.approximate = True
+        for part in ["subjects", "predicates", "objects"]:
+            for instance, count in counts[part].items():
+                sketches[part].add(instance)
+                if isinstance(instance, URIRef):
+                    count_namespace_for(part, instance, count)
+            counts[part] = Counter()
+
+    def count_for(part: str, summary_part: SummaryPart) -> None:
+        summary_part.count = sketches[part].count() if summary.approximate else len(counts[part])
+
+        part_counts = counts[part] if not summary.approximate else \
+            {URIRef(namespace + namespace_samples[namespace]): count
+             for namespace, count in namespace_counts[part].items()}
+
+        for instance, count in part_counts.items():
+            qname = resolver.resolve(instance) if isinstance(instance, URIRef) else None
+            if qname is not None:
+                prefix, namespace, name = qname
+                summary.stats[prefix] = summary.stats.get(prefix, 0) + count
+                summary_part.stats[prefix] = summary_part.stats.get(prefix, 0) + count
+
+    def classes_count_for(part_counts: Counter, classes_summary: ClassesSummary) -> None:
+        classes_summary.count = part_counts.total()
+
+        for instance, count in part_counts.items():
+            qname = resolver.resolve(instance)
+            if qname is not None:
+                prefix, namespace, name = qname
+                prefix_stats = classes_summary.stats.get(prefix, {})
+                prefix_stats[name] = prefix_stats.get(name, 0) + count
+                classes_summary.stats[prefix] = prefix_stats
+
+    summary = Summary()
+    counts = {"subjects": Counter(), "predicates": Counter(), "objects": Counter(),
+              "classes": Counter(), "literals": Counter()}
+
+    # Used instead of the exact counts for the distinct terms after the approximate threshold is passed
+    sketches = {"subjects": HyperLogLog(summarizer_hll_precision), "predicates": HyperLogLog(summarizer_hll_precision),
+                "objects": HyperLogLog(summarizer_hll_precision)}
+    namespace_counts = {"subjects": Counter(), "predicates": Counter(), "objects": Counter()}
+    namespace_samples = {}
+
+    if streaming:
+        # Triples are counted as they come out of the parser, so memory is bounded by the number of distinct terms
+        graph = create_streaming_graph(summarize_triple)
+        try:
+            load_cached_into_graph(graph, path)
+        except SAXParseException:
+            log.warning(f'Failed to stream {path}, loading it into memory instead')
+            return summarize(path, False)
+    else:
+        graph = Graph(bind_namespaces='core')
+        load_cached_into_graph(graph, path)
+
+        for triple in graph:
+            summarize_triple(triple)
+
+    # Some parsers only declare their namespaces at the end, so the terms are only split once everything is parsed
+    summary.prefixes = {prefix: str(namespace) for prefix, namespace in graph.namespaces()}
+    resolver = NamespaceResolver(summary.prefixes.items())
+
+    count_for("subjects", summary.subjects)
+    count_for("predicates", summary.predicates)
+    count_for("objects", summary.objects)
+    classes_count_for(counts["classes"], summary.objects.classes)
+    classes_count_for(counts["literals"], summary.objects.literals)
 
     return summary
 
 
-def write_summary_statements(nr: int, id: int, version: str, summary: Summary) -> None:
+def write_summary_statements(nr: int, id: int, summaries: List[Tuple[str, Summary]]) -> None:
     def write_namespaces(root: Element, stats: dict[str, int], prefixes: dict[str, str]) -> None:
         namespaces = etree.SubElement(root, f"{ns_prefix}Namespaces", nsmap=ns)
         for prefix, count in stats.items():
@@ -121,7 +225,7 @@ def write_summary_statements(nr: int, id: int, version: str, summary: Summary) -
                 namespace = etree.SubElement(namespaces, f"{ns_prefix}Namespace", nsmap=ns)
 
                 uri_elem = etree.SubElement(namespace, f"{ns_prefix}URI", nsmap=ns)
-                uri_elem.text = summary.prefixes[prefix]
+                uri_elem.text = prefixes[prefix]
 
                 prefix_elem = etree.SubElement(namespace, f"{ns_prefix}prefix", nsmap=ns)
                 prefix_elem.text = prefix
@@ -137,7 +241,7 @@ def write_summary_statements(nr: int, id: int, version: str, summary: Summary) -
                     namespace_item_elem = etree.SubElement(namespace_items_elem, f"{ns_prefix}NamespaceItem", nsmap=ns)
 
                     namespace_item_uri_elem = etree.SubElement(namespace_item_elem, f"{ns_prefix}URI", nsmap=ns)
-                    namespace_item_uri_elem.text = summary.prefixes[prefix]
+                    namespace_item_uri_elem.text = prefixes[prefix]
 
                     namespace_item_prefix_elem = etree.SubElement(namespace_item_elem, f"{ns_prefix}prefix", nsmap=ns)
                     namespace_item_prefix_elem.text = prefix
@@ -148,69 +252,79 @@ def write_summary_statements(nr: int, id: int, version: str, summary: Summary) -
                     namespace_item_count_elem = etree.SubElement(namespace_item_elem, f"{ns_prefix}count", nsmap=ns)
                     namespace_item_count_elem.text = str(count)
 
-    with cmdi_from_redis(nr, id) as root:
-        version_elem = grab_first(f"{voc_root}/cmd:Version/cmd:version[text()='{version}']/..", root)
-        if version_elem is not None:
-            summary_elem = grab_first("./cmd:Summary", version_elem)
-            # if summary_elem is not None:
-            #     version_elem.remove(summary_elem)
-            if summary_elem is None:
-                summary_elem = etree.SubElement(version_elem, f"{ns_prefix}Summary", nsmap=ns)
-
-            namespaces = grab_first("./cmd:Namespaces", summary_elem)
-            if namespaces is not None:
-                summary_elem.remove(namespaces)
-
-            statements = grab_first("./cmd:Statements", summary_elem)
-            if statements is not None:
-                summary_elem.remove(statements)
-
-            statements = etree.SubElement(summary_elem, f"{ns_prefix}Statements", nsmap=ns)
-
-            subjects = etree.SubElement(statements, f"{ns_prefix}Subjects", nsmap=ns)
-            subjects_count = etree.SubElement(subjects, f"{ns_prefix}count", nsmap=ns)
-            subjects_count.text = str(summary.subjects.count)
-
-            predicates = etree.SubElement(statements, f"{ns_prefix}Predicates", nsmap=ns)
-            predicates_count = etree.SubElement(predicates, f"{ns_prefix}count", nsmap=ns)
-            predicates_count.text = str(summary.predicates.count)
-
-            objects = etree.SubElement(statements, f"{ns_prefix}Objects", nsmap=ns)
-            objects_count = etree.SubElement(objects, f"{ns_prefix}count", nsmap=ns)
-            objects_count.text = str(summary.objects.count)
-
-            object_classes = etree.SubElement(objects, f"{ns_prefix}Classes", nsmap=ns)
-            object_classes_count = etree.SubElement(object_classes, f"{ns_prefix}count", nsmap=ns)
-            object_classes_count.text = str(summary.objects.classes.count)
-
-            object_literals = etree.SubElement(objects, f"{ns_prefix}Literals", nsmap=ns)
-            object_literals_count = etree.SubElement(object_literals, f"{ns_prefix}count", nsmap=ns)
-            object_literals_count.text = str(summary.objects.literals.count)
-
-            literal_languages = etree.SubElement(object_literals, f"{ns_prefix}Languages", nsmap=ns)
-            if summary.objects.literals.languages:
-                for lang, count in summary.objects.literals.languages.items():
-                    literal_language = etree.SubElement(literal_languages, f"{ns_prefix}Language", nsmap=ns)
-
-                    literal_language_code = etree.SubElement(literal_language, f"{ns_prefix}code", nsmap=ns)
-                    literal_language_code.text = lang
-
-                    literal_language_count = etree.SubElement(literal_language, f"{ns_prefix}count", nsmap=ns)
-                    literal_language_count.text = str(count)
-
-            write_namespaces(summary_elem, summary.stats, summary.prefixes)
-            write_namespaces(subjects, summary.subjects.stats, summary.prefixes)
-            write_namespaces(predicates, summary.predicates.stats, summary.prefixes)
-            write_namespaces(objects, summary.objects.stats, summary.prefixes)
-            write_namespaces(object_classes, {prefix: sum(name_counts.values())
-                                              for prefix, name_counts in summary.objects.classes.stats.items()},
-                             summary.prefixes)
-            write_namespaces(object_literals, {prefix: sum(name_counts.values())
-                                               for prefix, name_counts in summary.objects.literals.stats.items()},
-                             summary.prefixes)
-
-            write_namespace_items(object_classes, summary.objects.classes.stats, summary.prefixes)
-            write_namespace_items(object_literals, summary.objects.literals.stats, summary.prefixes)
+    if not summaries:
+        return
+
+    def apply(root: Element) -> None:
+        for version, summary in summaries:
+            version_elem = grab_first(f"{voc_root}/cmd:Version/cmd:version[text()='{version}']/..", root)
+            if version_elem is not None:
+                summary_elem = grab_first("./cmd:Summary", version_elem)
+                # if summary_elem is not None:
+                #     version_elem.remove(summary_elem)
+                if summary_elem is None:
+                    summary_elem = etree.SubElement(version_elem, f"{ns_prefix}Summary", nsmap=ns)
+
+                namespaces = grab_first("./cmd:Namespaces", summary_elem)
+                if namespaces is not None:
+                    summary_elem.remove(namespaces)
+
+                statements = grab_first("./cmd:Statements", summary_elem)
+                if statements is not None:
+                    summary_elem.remove(statements)
+
+                statements = etree.SubElement(summary_elem, f"{ns_prefix}Statements", nsmap=ns)
+                if summary.approximate:
+                    statements.set('approximate', 'true')
+                if summary.fingerprint:
+                    statements.set('fingerprint', summary.fingerprint)
+
+                subjects = etree.SubElement(statements, f"{ns_prefix}Subjects", nsmap=ns)
+                subjects_count = etree.SubElement(subjects, f"{ns_prefix}count", nsmap=ns)
+                subjects_count.text = str(summary.subjects.count)
+
+                predicates = etree.SubElement(statements, f"{ns_prefix}Predicates", nsmap=ns)
+                predicates_count = etree.SubElement(predicates, f"{ns_prefix}count", nsmap=ns)
+                predicates_count.text = str(summary.predicates.count)
+
+                objects = etree.SubElement(statements, f"{ns_prefix}Objects", nsmap=ns)
+                objects_count = etree.SubElement(objects, f"{ns_prefix}count", nsmap=ns)
+                objects_count.text = str(summary.objects.count)
+
+                object_classes = etree.SubElement(objects, f"{ns_prefix}Classes", nsmap=ns)
+                object_classes_count = etree.SubElement(object_classes, f"{ns_prefix}count", nsmap=ns)
+                object_classes_count.text = str(summary.objects.classes.count)
+
+                object_literals = etree.SubElement(objects, f"{ns_prefix}Literals", nsmap=ns)
+                object_literals_count = etree.SubElement(object_literals, f"{ns_prefix}count", nsmap=ns)
+                object_literals_count.text = str(summary.objects.literals.count)
+
+                literal_languages = etree.SubElement(object_literals, f"{ns_prefix}Languages", nsmap=ns)
+                if summary.objects.literals.languages:
+                    for lang, count in summary.objects.literals.languages.items():
+                        literal_language = etree.SubElement(literal_languages, f"{ns_prefix}Language", nsmap=ns)
+
+                        literal_language_code = etree.SubElement(literal_language, f"{ns_prefix}code", nsmap=ns)
+                        literal_language_code.text = lang
+
+                        literal_language_count = etree.SubElement(literal_language, f"{ns_prefix}count", nsmap=ns)
+                        literal_language_count.text = str(count)
+
+                write_namespaces(summary_elem, summary.stats, summary.prefixes)
+                write_namespaces(subjects, summary.subjects.stats, summary.prefixes)
+                write_namespaces(predicates, summary.predicates.stats, summary.prefixes)
+                write_namespaces(objects, summary.objects.stats, summary.prefixes)
+                write_namespaces(object_classes, {prefix: sum(name_counts.values())
+                                                  for prefix, name_counts in summary.objects.classes.stats.items()},
+                                 summary.prefixes)
+                write_namespaces(object_literals, {prefix: sum(name_counts.values())
+                                                   for prefix, name_counts in summary.objects.literals.stats.items()},
+                                 summary.prefixes)
+
+                write_namespace_items(object_classes, summary.objects.classes.stats, summary.prefixes)
+                write_namespace_items(object_literals, summary.objects.literals.stats, summary.prefixes)
+
+    mutate(nr, id, apply)
 
 
 if __name__ == '__main__':
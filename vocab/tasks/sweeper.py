@@ -0,0 +1,44 @@
+import sys
+import time
+import logging
+
+from vocab.app import celery
+from vocab.config import work_item_ttl, work_item_orphan_age
+from vocab.util.redis import scan_work_items_redis, delete_work_items_redis
+
+log = logging.getLogger(__name__)
+
+
+@celery.task(name='sweeper')
+def sweep_work_items(dry_run: bool = False, batch_size: int = 100) -> dict:
+    now = time.time()
+    items, memory, orphans, orphans_memory = 0, 0, [], 0
+    for item in scan_work_items_redis(batch_size):
+        items += 1
+        memory += item['memory']
+
+        # The TTL is refreshed on every access, so the remaining TTL tells when it was last used;
+        # work items without a TTL are from before expiry was introduced and carry their creation time in their id
+        if item['ttl'] >= 0:
+            idle = work_item_ttl - item['ttl']
+        else:
+            idle = now - int(item['key'].split(':')[1])
+
+        if idle > work_item_orphan_age:
+            log.info(f"Orphaned work item {item['key']}: {item['type']} of {item['memory']} bytes "
+                     f"({item['size'] or '?'} bytes of XML), idle for {idle:.0f} seconds")
+            orphans.append(item['key'])
+            orphans_memory += item['memory']
+
+    if not dry_run:
+        for i in range(0, len(orphans), batch_size):
+            delete_work_items_redis(orphans[i:i + batch_size])
+
+    log.info(f"Found {items} work items using {memory} bytes; "
+             f"{'found' if dry_run else 'reclaimed'} {len(orphans)} orphaned work items using {orphans_memory} bytes")
+
+    return {'items': items, 'memory': memory, 'orphans': orphans, 'orphans_memory': orphans_memory}
+
+
+if __name__ == '__main__':
+    sweep_work_items(dry_run='--dry-run' in sys.argv[1:])
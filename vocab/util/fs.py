@@ -1,12 +1,196 @@
 import os
+import uuid
+import sqlite3
+import hashlib
+import threading
+
+from typing import Optional
+from datetime import datetime
+from pydantic import BaseModel
 
 from vocab.config import root_path, cache_rel_path
 
+# Connections to the cache index are kept per thread, as they cannot be shared between threads
+cache_index = threading.local()
+
+
+class CacheMetadata(BaseModel):
+    url: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_length: int
+    hash: str
+    extension: Optional[str] = None
+    format: Optional[str] = None
+    modified: datetime
+    checked: datetime
+
 
 def get_cached_version(id: str, version: str) -> str | None:
-    folder = str(os.path.join(root_path, cache_rel_path, id))
-    if os.path.exists(folder):
-        for filename in os.listdir(folder):
-            if filename.startswith(version):
-                return os.path.join(folder, filename)
+    row = connect_cache_index().execute('SELECT path FROM entries WHERE identifier = ? AND version = ?',
+                                        (id, version)).fetchone()
+
+    if row is not None:
+        path = os.path.join(root_path, cache_rel_path, row[0])
+        if os.path.exists(path):
+            return path
+        remove_from_cache_index(id, version)
+
+    return None
+
+
+def get_cache_index_path() -> str:
+    return os.path.join(root_path, cache_rel_path, 'index.sqlite')
+
+
+def connect_cache_index() -> sqlite3.Connection:
+    # A connection is only valid in the process that opened it, and is opened again if the index was removed
+    index_path = get_cache_index_path()
+    connection = getattr(cache_index, 'connection', None)
+    if connection is not None and cache_index.pid == os.getpid() and os.path.exists(index_path):
+        return connection
+
+    if connection is not None and cache_index.pid == os.getpid():
+        connection.close()
+    if not os.path.exists(index_path):
+        create_cache_index(index_path)
+
+    cache_index.connection = sqlite3.connect(index_path, timeout=60, isolation_level=None)
+    cache_index.pid = os.getpid()
+
+    return cache_index.connection
+
+
+def create_cache_index(index_path: str) -> None:
+    # The index is set up under a temporary name, so other processes never open an index without its table;
+    # the journal mode is stored in the database itself, so it only has to be set once
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = f'{index_path}.{uuid.uuid4()}.tmp'
+    try:
+        connection = sqlite3.connect(tmp_path, isolation_level=None)
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE entries (identifier TEXT NOT NULL, version TEXT NOT NULL, '
+                               'path TEXT NOT NULL, format TEXT, size INTEGER, hash TEXT, '
+                               'PRIMARY KEY (identifier, version))')
+            rebuild_cache_index(connection)
+        finally:
+            connection.close()
+
+        if not os.path.exists(index_path):
+            os.replace(tmp_path, index_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def add_to_cache_index(id: str, version: str, cached_path: str, metadata: CacheMetadata | None) -> None:
+    connect_cache_index().execute('INSERT OR REPLACE INTO entries (identifier, version, path, format, size, hash) '
+                                  'VALUES (?, ?, ?, ?, ?, ?)', (
+                                      id, version,
+                                      os.path.relpath(cached_path, os.path.join(root_path, cache_rel_path)),
+                                      metadata.format if metadata is not None else None,
+                                      metadata.content_length if metadata is not None else None,
+                                      metadata.hash if metadata is not None else None,
+                                  ))
+
+
+def remove_from_cache_index(id: str, version: str) -> None:
+    connect_cache_index().execute('DELETE FROM entries WHERE identifier = ? AND version = ?', (id, version))
+
+
+def rebuild_cache_index(index: sqlite3.Connection) -> None:
+    cache_path = os.path.join(root_path, cache_rel_path)
+    entries = []
+    for folder in os.scandir(cache_path):
+        if folder.is_dir() and not folder.name.startswith('.'):
+            for file in os.scandir(folder.path):
+                if file.name.endswith('.gz') and not file.name.startswith('.'):
+                    version, extension = os.path.splitext(file.name[:-3])
+                    metadata = get_cache_metadata(file.path)
+                    entries.append((
+                        folder.name, version, os.path.relpath(file.path, cache_path),
+                        metadata.format if metadata is not None else None,
+                        metadata.content_length if metadata is not None else None,
+                        metadata.hash if metadata is not None else None,
+                    ))
+
+    index.execute('BEGIN')
+    index.execute('DELETE FROM entries')
+    index.executemany('INSERT OR REPLACE INTO entries (identifier, version, path, format, size, hash) '
+                      'VALUES (?, ?, ?, ?, ?, ?)', entries)
+    index.execute('COMMIT')
+
+
+def get_cached_hash(cached_path: str) -> str | None:
+    metadata = get_cache_metadata(cached_path)
+    return metadata.hash if metadata is not None else None
+
+
+def get_cached_content_key(cached_path: str) -> str:
+    # Files cached without a hash (before revalidation was enabled) are identified by their modification time and size
+    hash = get_cached_hash(cached_path)
+    if hash is not None:
+        return hash
+
+    stat = os.stat(cached_path)
+    return f'stat:{stat.st_mtime_ns}:{stat.st_size}'
+
+
+def get_blob_path(hash: str) -> str:
+    return os.path.join(root_path, cache_rel_path, '.blobs', hash[:2], hash + '.gz')
+
+
+def get_cache_metadata_path(cached_path: str) -> str:
+    return cached_path + '.json'
+
+
+def get_cache_metadata(cached_path: str) -> CacheMetadata | None:
+    return read_metadata(get_cache_metadata_path(cached_path))
+
+
+def write_cache_metadata(cached_path: str, metadata: CacheMetadata) -> None:
+    write_metadata(get_cache_metadata_path(cached_path), metadata)
+
+
+def get_url_metadata_path(url: str) -> str:
+    return os.path.join(root_path, cache_rel_path, '.urls', hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+
+def get_url_metadata(url: str) -> CacheMetadata | None:
+    return read_metadata(get_url_metadata_path(url))
+
+
+def write_url_metadata(metadata: CacheMetadata) -> None:
+    metadata_path = get_url_metadata_path(metadata.url)
+    os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+    write_metadata(metadata_path, metadata)
+
+
+def read_metadata(metadata_path: str) -> CacheMetadata | None:
+    if os.path.exists(metadata_path):
+        with open(metadata_path, 'r') as f:
+            return CacheMetadata.model_validate_json(f.read())
     return None
+
+
+def write_metadata(metadata_path: str, metadata: CacheMetadata) -> None:
+    tmp_path = f'{metadata_path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(metadata.model_dump_json(indent=4))
+    os.replace(tmp_path, metadata_path)
+
+
+def link_file(source: str, path: str) -> None:
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    if os.path.exists(path) and os.path.samefile(source, path):
+        return
+
+    # Prefer a hardlink, but fall back to a relative symlink if the source lives on another device
+    tmp_path = os.path.join(folder, f'.{os.path.basename(path)}.{uuid.uuid4().hex}.tmp')
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        os.symlink(os.path.relpath(source, folder), tmp_path)
+    os.replace(tmp_path, path)
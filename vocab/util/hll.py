@@ -0,0 +1,51 @@
+import math
+
+from typing import Hashable
+
+MASK_64 = (1 << 64) - 1
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch for approximate distinct counting.
+
+    Uses 2^precision one-byte registers; the relative standard error of the estimate is 1.04 / sqrt(2^precision),
+    e.g. 0.81% with the default precision of 14 (16 KB of registers).
+    """
+
+    def __init__(self, precision: int = 14):
+        if not 4 <= precision <= 18:
+            raise ValueError(f'Precision should be between 4 and 18, got {precision}')
+
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+        self.alpha = 0.7213 / (1 + 1.079 / self.size) if self.size >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[
+            self.size]
+
+    @property
+    def error(self) -> float:
+        return 1.04 / math.sqrt(self.size)
+
+    def add(self, value: Hashable) -> None:
+        # Mix the Python hash with the SplitMix64 finalizer to spread the bits evenly
+        hash = value.__hash__() & MASK_64
+        hash = ((hash ^ (hash >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+        hash = ((hash ^ (hash >> 27)) * 0x94D049BB133111EB) & MASK_64
+        hash ^= hash >> 31
+
+        index = hash >> (64 - self.precision)
+        rest = hash & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        estimate = self.alpha * self.size * self.size / sum(2.0 ** -register for register in self.registers)
+
+        # Linear counting is more accurate for small cardinalities
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * math.log(self.size / zeros)
+
+        return round(estimate)
@@ -0,0 +1,120 @@
+import sys
+import time
+
+from functools import lru_cache
+from typing import Iterable, Tuple
+
+from rdflib import Graph, URIRef
+from rdflib.term import _is_valid_uri
+from rdflib.namespace import split_uri
+
+
+def split_iri(iri: str) -> Tuple[str, str] | None:
+    # Splits like compute_qname: at the start of the trailing name, which may also start with a digit;
+    # an IRI that cannot be split is only resolved if the whole IRI is a namespace
+    if not _is_valid_uri(iri):
+        return None
+    try:
+        namespace, name = split_uri(iri)
+        return str(namespace), name
+    except ValueError:
+        return iri, ''
+
+
+class NamespaceResolver:
+    """Splits IRIs into (prefix, namespace, local name) like compute_qname, using the longest bound namespace."""
+
+    def __init__(self, namespaces: Iterable[Tuple[str, str]], memo_size: int = 65536):
+        # Radix trie: every node is a [value, {first character: (edge label, child node)}] pair
+        self.trie = [None, {}]
+        for prefix, namespace in namespaces:
+            self.insert(str(namespace), (prefix, URIRef(namespace)))
+
+        # Unresolvable IRIs are memoized as None as well, so they are only walked once
+        self.memo = lru_cache(maxsize=memo_size)(self.resolve_uncached)
+
+    def insert(self, key: str, value: Tuple[str, URIRef]) -> None:
+        node, pos = self.trie, 0
+        while pos < len(key):
+            edge = node[1].get(key[pos])
+            if edge is None:
+                node[1][key[pos]] = (key[pos:], [value, {}])
+                return
+
+            label, child = edge
+            common = 0
+            while common < len(label) and pos + common < len(key) and label[common] == key[pos + common]:
+                common += 1
+
+            if common < len(label):
+                child = [None, {label[common]: (label[common:], child)}]
+                node[1][key[pos]] = (label[:common], child)
+
+            node, pos = child, pos + common
+        node[0] = value
+
+    def resolve(self, iri: str) -> Tuple[str, URIRef, str] | None:
+        return self.memo(str(iri))
+
+    def resolve_uncached(self, iri: str) -> Tuple[str, URIRef, str] | None:
+        split = split_iri(iri)
+        if split is None:
+            return None
+
+        # Like compute_qname, only a bound namespace that is at least as long as the split namespace is used
+        match = None
+        node, pos = self.trie, 0
+        while True:
+            if node[0] is not None and pos >= len(split[0]):
+                match = pos, node[0]
+
+            edge = node[1].get(iri[pos]) if pos < len(iri) else None
+            if edge is None or not iri.startswith(edge[0], pos):
+                break
+            node, pos = edge[1], pos + len(edge[0])
+
+        if match is None:
+            return None
+
+        end, (prefix, namespace) = match
+        return prefix, namespace, iri[end:]
+
+
+def benchmark(path: str, repeat: int = 3) -> None:
+    graph = Graph(bind_namespaces='core')
+    graph.parse(path)
+
+    iris = [term for triple in graph for term in triple if isinstance(term, URIRef)]
+    namespaces = list(graph.namespaces())
+    print(f'{len(iris)} IRIs ({len(set(iris))} distinct) and {len(namespaces)} namespaces in {path}')
+
+    for i in range(repeat):
+        compute_qname_graph = Graph(bind_namespaces='none')
+        for prefix, namespace in namespaces:
+            compute_qname_graph.bind(prefix, namespace)
+
+        start = time.perf_counter()
+        expected = []
+        for iri in iris:
+            try:
+                expected.append(compute_qname_graph.compute_qname(iri, generate=False))
+            except:
+                expected.append(None)
+        compute_qname_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        resolver = NamespaceResolver(namespaces)
+        resolved = [resolver.resolve(iri) for iri in iris]
+        resolver_time = time.perf_counter() - start
+
+        same = sum(1 for a, b in zip(expected, resolved) if a == b)
+        print(f'Run {i + 1}: compute_qname {compute_qname_time:.3f}s, resolver {resolver_time:.3f}s '
+              f'({compute_qname_time / resolver_time:.1f}x), {same}/{len(iris)} identical')
+
+        if same != len(iris):
+            different = next(iri for iri, a, b in zip(iris, expected, resolved) if a != b)
+            sys.exit(f'The resolver differs from compute_qname for {len(iris) - same} IRIs, e.g. {different}')
+
+
+if __name__ == '__main__':
+    benchmark(sys.argv[1])
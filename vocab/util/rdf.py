@@ -1,17 +1,45 @@
+import os
+import re
+import zlib
 import gzip
+import heapq
+import pickle
+import random
+import hashlib
+import logging
+import time
 import xml.sax
+import tempfile
 import requests
 
+from requests import Session
+from requests.adapters import HTTPAdapter
+from io import BytesIO
+from queue import Queue
+from threading import Lock, Thread
+from itertools import islice
+from collections import OrderedDict, Counter
+from typing import Iterable, Generator, Tuple, Any, Callable
+
 from rdflib import Graph, BNode
 from rdflib.term import Node
 from rdflib.util import guess_format
+from rdflib.query import Result
 from rdflib.parser import Parser
-from rdflib.graph import BatchAddGraph
-from rdflib.exceptions import ParserError
-from rdflib.plugin import PluginException, register
-from rdflib.plugins.stores.sparqlstore import SPARQLUpdateStore, _node_to_sparql
+from rdflib.plugin import register
+from rdflib.plugins.stores.memory import Memory
+from rdflib.plugins.serializers.nt import _nt_row
+from rdflib.plugins.stores.sparqlstore import _node_to_sparql
+
+from vocab.config import sparql_url, sparql_update_url, sparql_user, sparql_password, root_path, cache_rel_path, \
+    graph_cache_size, graph_cache_disk_size, sparql_graph_store_url, sparql_load_chunk_size, sparql_graph_cache_ttl, \
+    sparql_load_workers, sparql_load_queue_size, sparql_pool_size, sparql_connect_timeout, sparql_read_timeout, \
+    sparql_retries, sparql_gzip
+from vocab.util.fs import get_cached_hash, get_cached_content_key, get_cache_metadata, get_blob_path
+from vocab.util.redis import get_graph_counts_redis, store_graph_count_redis, get_graph_checkpoint_redis, \
+    store_graph_checkpoint_redis, delete_graph_checkpoint_redis
 
-from vocab.config import sparql_url, sparql_update_url, sparql_user, sparql_password
+log = logging.getLogger(__name__)
 
 register('rdfs', Parser, 'rdflib.plugins.parsers.rdfxml', 'RDFXMLParser')
 register('owl', Parser, 'rdflib.plugins.parsers.rdfxml', 'RDFXMLParser')
@@ -30,6 +58,231 @@ content_type_extensions = {
     'text/trig': 'trig'
 }
 
+canonical_prefix_regex = re.compile(r'^# @prefix ([^:\s]*): <([^>]*)> \.$')
+sort_chunk_size = 500_000
+
+sniff_size = 8 * 1024
+sniff_term = r'(?:<[^<>"{}|^`\\\s]*>|_:\S+)'
+sniff_literal = r'"(?:[^"\\]|\\.)*"(?:@[a-zA-Z]+(?:-[a-zA-Z0-9]+)*|\^\^<[^>\s]*>)?'
+sniff_ntriples_regex = re.compile(rf'^{sniff_term}\s+<[^>\s]*>\s+(?:{sniff_term}|{sniff_literal})\s*\.\s*(?:#.*)?$')
+sniff_nquads_regex = re.compile(
+    rf'^{sniff_term}\s+<[^>\s]*>\s+(?:{sniff_term}|{sniff_literal})\s+{sniff_term}\s*\.\s*(?:#.*)?$')
+sniff_turtle_regex = re.compile(r'^(?:@prefix|@base|prefix|base)\b', re.IGNORECASE)
+
+
+class GraphCache:
+    """Cache of parsed graphs, pickled on disk and optionally kept pickled in memory within a byte budget."""
+
+    def __init__(self, folder: str, memory_size: int, disk_size: int):
+        self.folder = folder
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key_for(self, cached_version_path: str) -> str:
+        hash = get_cached_hash(cached_version_path)
+        if hash is not None:
+            return hash
+
+        stat = os.stat(cached_version_path)
+        return hashlib.sha256(f'{os.path.realpath(cached_version_path)}:{stat.st_mtime_ns}:{stat.st_size}'
+                              .encode('utf-8')).hexdigest()
+
+    def get(self, cached_version_path: str) -> Any | None:
+        key = self.key_for(cached_version_path)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                data = self.memory[key]
+            else:
+                data = None
+
+        # The pickled bytes are kept instead of the parsed graph, so that the budget is what is actually held in memory
+        if data is not None:
+            return pickle.loads(data)
+
+        path = os.path.join(self.folder, key + '.pickle')
+        if self.disk_size > 0 and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)
+            except FileNotFoundError:
+                data = None
+
+            if data is not None:
+                with self.lock:
+                    self.disk_hits += 1
+                self.put_in_memory(key, data)
+                return pickle.loads(data)
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, cached_version_path: str, value: Any) -> None:
+        key = self.key_for(cached_version_path)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.put_in_memory(key, data)
+
+        if self.disk_size > 0:
+            os.makedirs(self.folder, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.', suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self.folder, key + '.pickle'))
+            self.evict_from_disk()
+
+    def put_in_memory(self, key: str, data: bytes) -> None:
+        if len(data) > self.memory_size:
+            return
+
+        with self.lock:
+            if key in self.memory:
+                self.memory_used -= len(self.memory.pop(key))
+
+            self.memory[key] = data
+            self.memory_used += len(data)
+
+            while self.memory_used > self.memory_size:
+                evicted_key, evicted_data = self.memory.popitem(last=False)
+                self.memory_used -= len(evicted_data)
+
+    def evict_from_disk(self) -> None:
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.pickle'):
+                try:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                except FileNotFoundError:
+                    pass
+
+        # Least recently used first; hits touch the file
+        entries.sort()
+        disk_used = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if disk_used <= self.disk_size:
+                break
+            try:
+                os.remove(path)
+                disk_used -= size
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'entries': len(self.memory), 'memory_used': self.memory_used}
+
+
+graph_cache = GraphCache(os.path.join(root_path, cache_rel_path, '.graphs'),
+                         graph_cache_size * 1024 * 1024, graph_cache_disk_size * 1024 * 1024)
+
+
+class SparqlClient:
+    """Process-wide client for the SPARQL endpoints, reusing keep-alive connections for queries, updates and uploads."""
+
+    retry_status_codes = {429, 500, 502, 503, 504}
+
+    def __init__(self, pool_size: int, connect_timeout: float, read_timeout: float, retries: int,
+                 backoff: float = 1, gzip_bodies: bool = False):
+        self.session = Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+        self.session.auth = (sparql_user, sparql_password) if sparql_user else None
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.gzip_bodies = gzip_bodies
+
+    def query(self, query: str) -> Result:
+        response = self.request('POST', sparql_url, data=query.encode('utf-8'), headers={
+            'Content-Type': 'application/sparql-query; charset=utf-8',
+            'Accept': 'application/sparql-results+json'
+        })
+        return Result.parse(BytesIO(response.content), format='json')
+
+    def update(self, update: str) -> None:
+        self.request('POST', sparql_update_url, data=update.encode('utf-8'), headers={
+            'Content-Type': 'application/sparql-update; charset=utf-8'
+        })
+
+    def upload(self, method: str, graph_uri: str, data: bytes | Iterable[bytes]) -> None:
+        self.request(method, sparql_graph_store_url, params={'graph': graph_uri}, data=data, headers={
+            'Content-Type': 'application/n-triples'
+        })
+
+    def request(self, method: str, url: str, data: bytes | Iterable[bytes], headers: dict[str, str],
+                params: dict[str, str] = None) -> requests.Response:
+        # A streamed body can only be sent once, so only requests with the body in memory are retried
+        retryable = isinstance(data, bytes)
+        if self.gzip_bodies:
+            data = gzip.compress(data) if retryable else compress_chunks(data)
+            headers = {**headers, 'Content-Encoding': 'gzip'}
+
+        for attempt in range(self.retries + 1):
+            last_attempt = not retryable or attempt == self.retries
+            try:
+                response = self.session.request(method, url, params=params, data=data, headers=headers,
+                                                timeout=self.timeout)
+                if response.status_code not in self.retry_status_codes or last_attempt:
+                    response.raise_for_status()
+                    return response
+
+                retry_after = response.headers.get('Retry-After', '')
+                delay = float(retry_after) if retry_after.isdigit() else self.backoff * 2 ** attempt
+                log.warning(f'SPARQL request to {url} failed with status {response.status_code}, retrying')
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last_attempt:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                log.warning(f'SPARQL request to {url} failed: {e}, retrying')
+
+            time.sleep(delay + random.uniform(0, delay))
+
+
+def compress_chunks(chunks: Iterable[bytes]) -> Generator[bytes, None, None]:
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+sparql_client = SparqlClient(max(sparql_pool_size, sparql_load_workers), sparql_connect_timeout, sparql_read_timeout,
+                             sparql_retries, gzip_bodies=sparql_gzip)
+
+
+class StreamingStore(Memory):
+    """Store that hands every parsed triple to a callback instead of keeping it."""
+
+    def __init__(self, on_triple: Callable[[Tuple[Node, Node, Node]], None]):
+        super().__init__()
+        self.on_triple = on_triple
+        self.count = 0
+
+    def add(self, triple, context, quoted=False) -> None:
+        if not quoted:
+            self.count += 1
+            self.on_triple(triple)
+
+    def addN(self, quads) -> None:
+        for s, p, o, c in quads:
+            self.add((s, p, o), c)
+
+
+def create_streaming_graph(on_triple: Callable[[Tuple[Node, Node, Node]], None],
+                           bind_namespaces: str = 'core') -> Graph:
+    return Graph(store=StreamingStore(on_triple), bind_namespaces=bind_namespaces)
+
 
 def encode_bnode_to_sparql(node: Node | str) -> str:
     if isinstance(node, BNode):
@@ -37,81 +290,466 @@ def encode_bnode_to_sparql(node: Node | str) -> str:
     return _node_to_sparql(node)
 
 
-def get_sparql_store(context_aware: bool = True) -> SPARQLUpdateStore:
-    return SPARQLUpdateStore(query_endpoint=sparql_url, update_endpoint=sparql_update_url,
-                             auth=(sparql_user, sparql_password) if sparql_user else None,
-                             node_to_sparql=encode_bnode_to_sparql, context_aware=context_aware)
+def get_graph_counts(graph_uris: list[str]) -> dict[str, int]:
+    # Only graphs that are known to be loaded are cached, so graphs that still have to be loaded are always checked
+    counts = dict(zip(graph_uris, get_graph_counts_redis(graph_uris)))
+    unknown = [graph_uri for graph_uri, count in counts.items() if count is None]
+    if unknown:
+        values = ' '.join(f'<{graph_uri}>' for graph_uri in unknown)
+        result = sparql_client.query(f'SELECT ?g (COUNT(*) AS ?count) '
+                                     f'WHERE {{ VALUES ?g {{ {values} }} GRAPH ?g {{ ?s ?p ?o }} }} GROUP BY ?g')
 
+        counts.update({graph_uri: 0 for graph_uri in unknown})
+        for row in result:
+            counts[str(row['g'])] = int(row['count'])
+            store_graph_count_redis(str(row['g']), int(row['count']), sparql_graph_cache_ttl)
 
-def load_cached_into_graph(graph: Graph, cached_version_path: str, use_batch: bool = False, format: str = None) -> None:
-    memory_graph = Graph() if use_batch else None
+    return counts
 
+
+def load_cached_into_graph(graph: Graph, cached_version_path: str, format: str = None) -> None:
     try:
-        use_format = format
-        if use_format is None:
-            use_format = guess_format(cached_version_path[:-3])
-            use_format = use_format if use_format is not None else 'xml'
-
-        with gzip.open(cached_version_path, 'r') as vocab_data:
-            (memory_graph if use_batch else graph).parse(vocab_data, format=use_format)
-
-        if use_batch:
-            with BatchAddGraph(graph, batch_size=200) as batch:
-                for triple in memory_graph:
-                    batch.add(triple)
+        streaming = isinstance(graph.store, StreamingStore)
+        cached_graph = graph_cache.get(cached_version_path) if format is None and not streaming else None
+
+        if cached_graph is not None:
+            namespaces, triples = cached_graph
+            for prefix, namespace in namespaces:
+                graph.bind(prefix, namespace, override=True, replace=True)
+            graph.addN((s, p, o, graph) for s, p, o in triples)
+        else:
+            # Only cache the namespaces declared by the data, not the defaults bound by the graph itself
+            default_namespaces = set(graph.namespaces())
+            canonical_path = get_canonical_path(cached_version_path) if format is None else None
+            if canonical_path is not None and os.path.exists(canonical_path):
+                load_canonical_into_graph(graph, canonical_path)
+            else:
+                extension_format = guess_format(cached_version_path[:-3])
+                use_format = format
+                if use_format is None:
+                    use_format = get_cached_format(cached_version_path)
+                if use_format is None:
+                    use_format = extension_format if extension_format is not None else 'xml'
+
+                try:
+                    with gzip.open(cached_version_path, 'r') as vocab_data:
+                        graph.parse(vocab_data, format=use_format)
+                except Exception:
+                    # A wrong guess of the sniffer falls back to the file extension,
+                    # unless triples were already streamed, as these cannot be taken back
+                    if format is not None or extension_format is None or extension_format == use_format \
+                            or (streaming and graph.store.count > 0):
+                        raise
+
+                    log.warning(f'Failed to parse {cached_version_path} as {use_format}, '
+                                f'retrying as {extension_format}')
+                    with gzip.open(cached_version_path, 'r') as vocab_data:
+                        graph.parse(vocab_data, format=extension_format)
+
+            if not streaming:
+                graph_cache.put(cached_version_path, ([namespace for namespace in graph.namespaces()
+                                                       if namespace not in default_namespaces], list(graph)))
+                log.debug(f'Graph cache for {cached_version_path}: {graph_cache.stats()}')
     except xml.sax._exceptions.SAXParseException:
-        if format is None:
-            load_cached_into_graph(graph, cached_version_path, use_batch, 'ttl')
+        # Triples that were already streamed cannot be taken back, so only retry when the graph keeps them
+        if format is None and not isinstance(graph.store, StreamingStore):
+            load_cached_into_graph(graph, cached_version_path, 'ttl')
+        elif format is None:
+            raise
         else:
             raise Exception(f"Failed to parse RDF data in {cached_version_path} with format {format}")
 
 
-def load_cached_into_remote(graph_uri: str, cached_version_path: str, format: str = None) -> None:
+def get_cached_format(cached_version_path: str) -> str | None:
+    metadata = get_cache_metadata(cached_version_path)
+    if metadata is not None and metadata.format is not None:
+        return metadata.format
+
+    with gzip.open(cached_version_path, 'r') as vocab_data:
+        return sniff_format(vocab_data.read(sniff_size), guess_format(cached_version_path[:-3]))
+
+
+def sniff_format(head: bytes, hint: str | None = None) -> str | None:
+    # The hint is the format according to the file extension or content type;
+    # it decides between formats that look the same at the start of the content
+    format = sniff_content_format(head)
+    if format == 'turtle' and hint in ('n3', 'trig'):
+        return hint
+    return format
+
+
+def sniff_content_format(head: bytes) -> str | None:
+    text = head.decode('utf-8', errors='ignore').lstrip('\ufeff \t\r\n')
+    if not text:
+        return None
+
+    if text.startswith('<?xml') or text.startswith('<!') or re.match(r'^<[A-Za-z_][\w.-]*(?::[\w.-]+)?[\s/>]', text):
+        return 'trix' if re.search(r'<(?:\w+:)?TriX[\s>]', text) else 'xml'
+
+    # A Turtle collection or blank node may also start with '[', a JSON-LD array starts with an object
+    if text[0] == '{' or re.match(r'^\[\s*\{', text):
+        return 'json-ld'
+
+    # The last line may be cut off by the sniff size, so it is not taken into account
+    lines = [line.strip() for line in text.splitlines()[:-1] if line.strip() and not line.lstrip().startswith('#')]
+    if not lines:
+        lines = [line.strip() for line in text.splitlines() if line.strip() and not line.lstrip().startswith('#')]
+    if not lines:
+        return None
+
+    if sniff_turtle_regex.match(lines[0]):
+        return 'turtle'
+    if all(sniff_ntriples_regex.match(line) for line in lines):
+        return 'nt'
+    if all(sniff_nquads_regex.match(line) for line in lines):
+        return 'nquads'
+    if lines[0].startswith('<') or lines[0].startswith('_:') or re.match(r'^[\w-]*:', lines[0]):
+        return 'turtle'
+
+    return None
+
+
+def get_canonical_path(cached_version_path: str) -> str | None:
+    hash = get_cached_hash(cached_version_path)
+    return get_canonical_path_for_hash(hash) if hash is not None else None
+
+
+def get_canonical_path_for_hash(hash: str) -> str:
+    return get_blob_path(hash)[:-3] + '.nt.gz'
+
+
+def write_canonical(graph: Graph, canonical_path: str) -> None:
+    labels = get_canonical_bnode_labels(graph)
+
+    def relabel(node: Node) -> Node:
+        return labels[node] if isinstance(node, BNode) else node
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(canonical_path), prefix='.', suffix='.tmp')
     try:
-        if format is None:
-            format = guess_format(cached_version_path[:-3])
-            format = format if format is not None else 'xml'
-
-        content_types = {
-            'xml': 'application/rdf+xml',
-            'turtle': 'text/turtle',
-            'ttl': 'text/turtle',
-            'nt': 'application/n-triples',
-            'n3': 'text/n3',
-            'json-ld': 'application/ld+json',
-            'trig': 'application/trig',
-            'nquads': 'application/n-quads',
-        }
-        content_type = content_types.get(format, 'application/rdf+xml')
-
-        with open(cached_version_path, 'rb') as vocab_data:
-            params = {'graph': graph_uri}
-            headers = {'Content-Type': content_type}
-            auth = (sparql_user, sparql_password) if sparql_user else None
-
-            response = requests.post(
-                sparql_update_url,
-                params=params,
-                data=vocab_data,
-                headers=headers,
-                auth=auth
-            )
-            response.raise_for_status()
+        with os.fdopen(fd, 'wb') as tmp_file, gzip.open(tmp_file, 'wt', encoding='utf-8') as canonical:
+            for prefix, namespace in sorted(graph.namespaces()):
+                canonical.write(f'# @prefix {prefix}: <{namespace}> .\n')
+            for line in sort_lines((_nt_row((relabel(s), p, relabel(o))) for s, p, o in graph), unique=True):
+                canonical.write(line)
+        os.replace(tmp_path, canonical_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def get_canonical_bnode_labels(graph: Graph) -> dict[BNode, BNode]:
+    # The labels of the parser differ for every parse, so blank nodes are labelled by the statements around them
+    # instead: every round, a label is the hash of its previous label and the statements with the labels of the
+    # neighbouring blank nodes, until no more blank nodes are told apart
+    triples = [(s, p, o) for s, p, o in graph if isinstance(s, BNode) or isinstance(o, BNode)]
+    labels = {node: '' for s, p, o in triples for node in (s, o) if isinstance(node, BNode)}
+
+    def label(node: Node) -> str:
+        return labels[node] if isinstance(node, BNode) else node.n3()
+
+    classes = 1 if labels else 0
+    while True:
+        statements = {node: [] for node in labels}
+        for s, p, o in triples:
+            if isinstance(s, BNode):
+                statements[s].append(f'> {p.n3()} {label(o)}')
+            if isinstance(o, BNode):
+                statements[o].append(f'< {label(s)} {p.n3()}')
+
+        labels = {node: hashlib.sha256('\n'.join([labels[node]] + sorted(statements[node])).encode('utf-8'))
+                  .hexdigest()[:32] for node in labels}
+        if len(set(labels.values())) <= classes:
+            break
+        classes = len(set(labels.values()))
+
+    # Blank nodes that cannot be told apart are numbered, which is only stable if they are interchangeable
+    canonical, numbers = {}, Counter()
+    for node in sorted(labels, key=lambda node: (labels[node], str(node))):
+        number = numbers[labels[node]]
+        numbers[labels[node]] += 1
+        canonical[node] = BNode(f'b{labels[node]}_{number}' if number else f'b{labels[node]}')
+
+    return canonical
+
+
+def read_canonical_prefixes(canonical_path: str) -> dict[str, str]:
+    prefixes = {}
+    with gzip.open(canonical_path, 'rt', encoding='utf-8') as canonical:
+        for line in canonical:
+            match = canonical_prefix_regex.match(line.rstrip('\n'))
+            if not match:
+                break
+            prefixes[match.group(1)] = match.group(2)
+    return prefixes
+
+
+def iter_canonical_lines(canonical_path: str) -> Generator[str, None, None]:
+    with gzip.open(canonical_path, 'rt', encoding='utf-8') as canonical:
+        for line in canonical:
+            if not line.startswith('#'):
+                yield line
+
+
+def load_canonical_into_graph(graph: Graph, canonical_path: str) -> None:
+    for prefix, namespace in read_canonical_prefixes(canonical_path).items():
+        graph.bind(prefix, namespace, override=True, replace=True)
+
+    with gzip.open(canonical_path, 'r') as canonical:
+        graph.parse(canonical, format='nt')
+
+
+def sort_lines(lines: Iterable[str], unique: bool = False) -> Generator[str, None, None]:
+    # External merge sort: sorted runs are spilled to temporary files, so memory is bounded by the chunk size
+    runs = []
+    try:
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) >= sort_chunk_size:
+                runs.append(write_sorted_run(chunk))
+                chunk = []
+
+        files = [open(run, 'r', encoding='utf-8') for run in runs]
+        try:
+            previous = None
+            for line in heapq.merge(*files, sorted(chunk)):
+                if not unique or line != previous:
+                    yield line
+                previous = line
+        finally:
+            for file in files:
+                file.close()
+    finally:
+        for run in runs:
+            os.remove(run)
+
+
+def write_sorted_run(chunk: list[str]) -> str:
+    fd, run_path = tempfile.mkstemp(suffix='.run')
+    with os.fdopen(fd, 'w', encoding='utf-8') as run:
+        run.writelines(sorted(chunk))
+    return run_path
+
+
+def load_cached_into_remote(graph_uri: str, cached_version_path: str, chunk_size: int = sparql_load_chunk_size,
+                            workers: int = sparql_load_workers) -> int:
+    # A Graph Store Protocol PUT replaces the graph; the body is streamed in chunks of N-Triples
+    start = time.perf_counter()
+    try:
+        # Also with a single sender, so that an interrupted load resumes from its checkpoint
+        total = load_cached_into_remote_concurrently(graph_uri, cached_version_path, chunk_size, max(workers, 1))
     except requests.RequestException as e:
-        if format is None:
-            load_cached_into_remote(graph_uri, cached_version_path, 'ttl')
+        raise Exception(f"Failed to load data into SPARQL store: {e}")
+
+    elapsed = time.perf_counter() - start
+    log.info(f'Loaded {total} triples into {graph_uri} in {elapsed:.1f}s ({total / elapsed:.0f} triples/sec)')
+    if total:
+        store_graph_count_redis(graph_uri, total, sparql_graph_cache_ttl)
+
+    return total
+
+
+def load_cached_into_remote_concurrently(graph_uri: str, cached_version_path: str, chunk_size: int,
+                                         workers: int) -> int:
+    # Blank node labels are only shared within a single request, so all statements with blank nodes
+    # are sent with the PUT; the remaining statements are added afterwards with concurrent POSTs
+    key = get_cached_content_key(cached_version_path)
+
+    def store_checkpoint(acknowledged: int) -> None:
+        # Sending statements again after an interruption is harmless, as the POSTs contain no blank nodes
+        store_graph_checkpoint_redis(graph_uri, {
+            'key': key,
+            'blank_node_triples': blank_node_triples,
+            'offset': acknowledged
+        })
+
+    checkpoint = get_graph_checkpoint_redis(graph_uri)
+    if checkpoint is not None and checkpoint.get('key') == key and checkpoint['blank_node_triples'] is not None:
+        blank_node_triples, offset = checkpoint['blank_node_triples'], checkpoint['offset']
+        log.info(f'Resuming load into {graph_uri} after {blank_node_triples + offset} triples')
+    else:
+        # The load is marked as started before the PUT, so an interrupted PUT is not mistaken for a loaded graph
+        blank_node_triples, offset = None, 0
+        store_checkpoint(offset)
+        blank_node_triples = send_to_graph_store('PUT', graph_uri, iter_batches(
+            (line for line in iter_ntriples(cached_version_path) if '_:' in line), chunk_size))
+
+    store_checkpoint(offset)
+    lines = islice((line for line in iter_ntriples(cached_version_path) if '_:' not in line), offset, None)
+    total = send_to_graph_store_concurrently(graph_uri, iter_batches(lines, chunk_size), workers,
+                                             offset, store_checkpoint)
+    delete_graph_checkpoint_redis(graph_uri)
+
+    return blank_node_triples + total
+
+
+def send_to_graph_store(method: str, graph_uri: str, batches: Iterable[Tuple[int, bytes]]) -> int:
+    total = 0
+
+    def chunks() -> Generator[bytes, None, None]:
+        nonlocal total
+        for count, batch in batches:
+            total += count
+            yield batch
+
+    sparql_client.upload(method, graph_uri, chunks())
+
+    return total
+
+
+def send_to_graph_store_concurrently(graph_uri: str, batches: Iterable[Tuple[int, bytes]], workers: int,
+                                    offset: int = 0, on_checkpoint: Callable[[int], None] = None) -> int:
+    # The bounded queue makes the producer wait for the senders, so at most `workers` requests are in flight
+    queue = Queue(maxsize=sparql_load_queue_size)
+    errors = []
+
+    # Batches are acknowledged out of order; the checkpoint only moves past batches that were all acknowledged
+    lock = Lock()
+    acknowledged = {}
+    next_index = 0
+    watermark = offset
+
+    def acknowledge(index: int, count: int) -> None:
+        nonlocal next_index, watermark
+        with lock:
+            acknowledged[index] = count
+            if next_index in acknowledged:
+                while next_index in acknowledged:
+                    watermark += acknowledged.pop(next_index)
+                    next_index += 1
+                if on_checkpoint is not None:
+                    on_checkpoint(watermark)
+
+    def send() -> None:
+        while True:
+            batch = queue.get()
+            if batch is None:
+                return
+            try:
+                if not errors:
+                    index, count, data = batch
+                    sparql_client.upload('POST', graph_uri, data)
+                    acknowledge(index, count)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [Thread(target=send, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for index, (count, data) in enumerate(batches):
+            if errors:
+                break
+            queue.put((index, count, data))
+    finally:
+        for _ in threads:
+            queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return watermark
+
+
+def iter_batches(lines: Iterable[str], chunk_size: int) -> Generator[Tuple[int, bytes], None, None]:
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield len(chunk), ''.join(chunk).encode('utf-8')
+            chunk = []
+
+    if chunk:
+        yield len(chunk), ''.join(chunk).encode('utf-8')
+
+
+def load_changes_into_remote(graph_uri: str, cached_version_path: str, previous_hash: str,
+                             chunk_size: int = sparql_load_chunk_size) -> bool:
+    # Only possible if both the previous and the new content were normalized and no statements with blank nodes were
+    # changed, as those cannot be matched with the blank nodes in the store; otherwise the graph should be loaded again
+    previous_canonical_path = get_canonical_path_for_hash(previous_hash)
+    canonical_path = get_canonical_path(cached_version_path)
+    if canonical_path is None or not os.path.exists(canonical_path) or not os.path.exists(previous_canonical_path):
+        return False
+
+    start = time.perf_counter()
+    with tempfile.TemporaryFile('w+', encoding='utf-8') as deletes, \
+            tempfile.TemporaryFile('w+', encoding='utf-8') as inserts:
+        for change, line in diff_sorted_lines(iter_canonical_lines(previous_canonical_path),
+                                              iter_canonical_lines(canonical_path)):
+            if '_:' in line:
+                return False
+            (deletes if change == '-' else inserts).write(line)
+
+        totals = {}
+        for operation, changes in (('DELETE DATA', deletes), ('INSERT DATA', inserts)):
+            changes.seek(0)
+            totals[operation] = 0
+            for count, batch in iter_batches(changes, chunk_size):
+                sparql_client.update(f'{operation} {{ GRAPH <{graph_uri}> {{ {batch.decode("utf-8")} }} }}')
+                totals[operation] += count
+
+    elapsed = time.perf_counter() - start
+    log.info(f'Deleted {totals["DELETE DATA"]} and inserted {totals["INSERT DATA"]} triples in {graph_uri} '
+             f'in {elapsed:.1f}s')
+
+    return True
+
+
+def diff_sorted_lines(old_lines: Iterable[str], new_lines: Iterable[str]) -> Generator[Tuple[str, str], None, None]:
+    # Merge of two sorted and unique streams of lines, yielding the removed ('-') and added ('+') lines
+    old_lines, new_lines = iter(old_lines), iter(new_lines)
+    old, new = next(old_lines, None), next(new_lines, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old < new):
+            yield '-', old
+            old = next(old_lines, None)
+        elif old is None or new < old:
+            yield '+', new
+            new = next(new_lines, None)
         else:
-            raise Exception(f"Failed to load data into SPARQL store: {e}")
+            old, new = next(old_lines, None), next(new_lines, None)
+
+
+def iter_ntriples(cached_version_path: str) -> Generator[str, None, None]:
+    canonical_path = get_canonical_path(cached_version_path)
+    if canonical_path is not None and os.path.exists(canonical_path):
+        yield from iter_canonical_lines(canonical_path)
+    elif get_cached_format(cached_version_path) == 'nt':
+        with gzip.open(cached_version_path, 'rt', encoding='utf-8') as vocab_data:
+            for line in vocab_data:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line + '\n'
+    else:
+        graph = Graph()
+        load_cached_into_graph(graph, cached_version_path)
+        for triple in graph:
+            yield _nt_row(triple)
 
 
 def load_remote_graph(url: str) -> Graph:
+    response = requests.get(url, headers={'Accept': ', '.join(content_type_extensions.keys())}, allow_redirects=True)
+    response.raise_for_status()
+
+    content_type = response.headers.get('content-type', '').split(';')[0]
+    hint = guess_format(content_type_extensions[content_type]) if content_type in content_type_extensions else None
+    if hint is None:
+        hint = guess_format(url)
+
+    format = sniff_format(response.content[:sniff_size], hint)
+    if format is None:
+        format = hint
+
     try:
-        return Graph().parse(location=url)
-    except (PluginException, ParserError):
-        try:
-            return Graph().parse(location=url, format=guess_format(url))
-        except (PluginException, ParserError):
-            try:
-                return Graph().parse(location=url, format='xml')
-            except (PluginException, ParserError):
-                return Graph().parse(location=url, format='ttl')
+        return Graph().parse(data=response.content, format=format if format is not None else 'xml')
+    except Exception:
+        if format is None:
+            return Graph().parse(data=response.content, format='ttl')
+        if hint is not None and hint != format:
+            return Graph().parse(data=response.content, format=hint)
+        raise
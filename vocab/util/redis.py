@@ -1,17 +1,158 @@
+import re
+import json
+import time
+import gzip
 import redis
 
-from vocab.config import redis_uri
+from typing import Callable, Generator
+
+from vocab.config import redis_uri, work_item_ttl, work_item_compress_threshold
 
 r = redis.Redis.from_url(redis_uri)
 
 
+def encode_work_item(nr: int, id: int, obj: bytes, created: float | None = None) -> dict:
+    # Small records are not worth the compression overhead
+    compress = len(obj) >= work_item_compress_threshold
+    now = time.time()
+    return {
+        'xml': gzip.compress(obj, compresslevel=6) if compress else obj,
+        'encoding': 'gzip' if compress else 'identity',
+        'size': len(obj),
+        'nr': nr,
+        'id': id,
+        'created': created if created is not None else now,
+        'updated': now,
+    }
+
+
+def decode_work_item(obj: bytes | None, encoding: bytes | None) -> bytes | None:
+    if obj is None:
+        return None
+    return gzip.decompress(obj) if encoding == b'gzip' else obj
+
+
 def store_object_redis(nr: int, id: int, obj: bytes):
-    r.set('{}:{}'.format(nr, id), obj)
+    # Any parsed record is outdated once the record itself is written
+    key = '{}:{}'.format(nr, id)
+    with r.pipeline() as pipe:
+        pipe.delete(key)
+        pipe.hset(key, mapping=encode_work_item(nr, id, obj))
+        pipe.expire(key, work_item_ttl)
+        pipe.delete('record:{}:{}'.format(nr, id))
+        pipe.execute()
+
+
+def update_object_redis(nr: int, id: int, update: Callable[[bytes], bytes | None], retries: int = 10) -> bool:
+    # Optimistic concurrency: the update is recomputed on the latest record whenever another writer got in between
+    key = '{}:{}'.format(nr, id)
+    with r.pipeline() as pipe:
+        for attempt in range(retries):
+            try:
+                pipe.watch(key)
+                obj, encoding, created = pipe.hmget(key, 'xml', 'encoding', 'created')
+                obj = update(decode_work_item(obj, encoding))
+                if obj is None:
+                    pipe.unwatch()
+                    return False
+
+                pipe.multi()
+                pipe.hset(key, mapping=encode_work_item(nr, id, obj, float(created) if created else None))
+                pipe.expire(key, work_item_ttl)
+                pipe.delete('record:{}:{}'.format(nr, id))
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                continue
+
+    raise redis.WatchError(f'Record {key} kept changing during {retries} update attempts')
 
 
 def get_object_redis(nr: int, id: int) -> bytes:
-    return r.get('{}:{}'.format(nr, id))
+    # Every access keeps the work item alive for another TTL
+    key = '{}:{}'.format(nr, id)
+    with r.pipeline() as pipe:
+        pipe.hmget(key, 'xml', 'encoding')
+        pipe.expire(key, work_item_ttl)
+        (obj, encoding), _ = pipe.execute()
+    return decode_work_item(obj, encoding)
 
 
 def delete_object_redis(nr: int, id: int):
-    r.delete('{}:{}'.format(nr, id))
+    r.delete('{}:{}'.format(nr, id), 'record:{}:{}'.format(nr, id))
+
+
+def scan_work_items_redis(batch_size: int = 100) -> Generator[dict, None, None]:
+    # Work items are the only keys that consist of just two numbers, e.g. '12:1700000000';
+    # the glob pattern only narrows down the scan, as it cannot express that
+    keys = (key.decode('utf-8') for key in r.scan_iter(match='[0-9]*:[0-9]*', count=batch_size))
+    keys = (key for key in keys if re.fullmatch(r'\d+:\d+', key))
+    while batch := [key for key, _ in zip(keys, range(batch_size))]:
+        with r.pipeline() as pipe:
+            for key in batch:
+                pipe.type(key)
+                pipe.ttl(key)
+                pipe.memory_usage(key)
+            info = pipe.execute()
+
+        types = [type.decode('utf-8') for type in info[0::3]]
+        with r.pipeline() as pipe:
+            for key, type in zip(batch, types):
+                if type == 'hash':
+                    pipe.hmget(key, 'updated', 'size')
+            metadata = iter(pipe.execute())
+
+        for key, type, ttl, memory in zip(batch, types, info[1::3], info[2::3]):
+            updated, size = next(metadata) if type == 'hash' else (None, None)
+            yield {
+                'key': key,
+                'type': type,
+                'ttl': ttl,
+                'memory': memory or 0,
+                'updated': float(updated) if updated else None,
+                'size': int(size) if size else None,
+            }
+
+
+def delete_work_items_redis(keys: list[str]):
+    if keys:
+        r.delete(*keys, *['record:{}'.format(key) for key in keys])
+
+
+def store_record_redis(nr: int, id: int, obj: bytes, ttl: int):
+    r.set('record:{}:{}'.format(nr, id), obj, ex=ttl)
+
+
+def get_record_redis(nr: int, id: int) -> bytes | None:
+    return r.get('record:{}:{}'.format(nr, id))
+
+
+def store_graph_count_redis(graph_uri: str, count: int, ttl: int):
+    r.set('sparql:count:{}'.format(graph_uri), count, ex=ttl)
+
+
+def get_graph_counts_redis(graph_uris: list[str]) -> list[int | None]:
+    counts = r.mget(['sparql:count:{}'.format(graph_uri) for graph_uri in graph_uris]) if graph_uris else []
+    return [int(count) if count is not None else None for count in counts]
+
+
+def store_graph_loaded_redis(graph_uri: str, hash: str):
+    r.set('sparql:loaded:{}'.format(graph_uri), hash)
+
+
+def get_graph_loaded_redis(graph_uri: str) -> str | None:
+    hash = r.get('sparql:loaded:{}'.format(graph_uri))
+    return hash.decode('utf-8') if hash is not None else None
+
+
+def store_graph_checkpoint_redis(graph_uri: str, checkpoint: dict):
+    r.set('sparql:checkpoint:{}'.format(graph_uri), json.dumps(checkpoint))
+
+
+def get_graph_checkpoint_redis(graph_uri: str) -> dict | None:
+    checkpoint = r.get('sparql:checkpoint:{}'.format(graph_uri))
+    return json.loads(checkpoint) if checkpoint is not None else None
+
+
+def delete_graph_checkpoint_redis(graph_uri: str):
+    r.delete('sparql:checkpoint:{}'.format(graph_uri))
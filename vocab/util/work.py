@@ -3,8 +3,10 @@ import re
 import time
 import logging
 
-from typing import Generator, Tuple
+from typing import Generator, Tuple, List, Any
 from contextlib import contextmanager
+from celery import Task, chord
+from celery.canvas import Signature
 
 from vocab.config import editor_uri
 from vocab.util.http import session
@@ -16,6 +18,7 @@ log = logging.getLogger(__name__)
 
 @contextmanager
 def run_work_for_file(file: str) -> Generator[Tuple[int, int], None, None]:
+    nr, id = None, None
     try:
         nr = int(re.search(r'record-(\d+)\.xml', file).group(1))
         id = int(time.time())
@@ -33,10 +36,12 @@ def run_work_for_file(file: str) -> Generator[Tuple[int, int], None, None]:
         with open(file, 'wb') as f:
             f.write(write_xml(xml, True))
 
-        delete_object_redis(nr, id)
         log.info(f"Finished work for {file} with nr {nr} and id {id}")
     except Exception as e:
         log.error(f"Error processing file {file}: {e}", exc_info=True)
+    finally:
+        if id is not None:
+            delete_object_redis(nr, id)
 
 
 @contextmanager
@@ -47,17 +52,19 @@ def run_work_for_record(nr: int) -> Generator[int, None, None]:
 
     store_object_redis(nr, id, response.content)
 
-    log.info(f"Start work for {nr} with id {id}")
-    yield id
+    try:
+        log.info(f"Start work for {nr} with id {id}")
+        yield id
 
-    log.info(f"Save XML back to editor for {nr} with id {id}")
+        log.info(f"Save XML back to editor for {nr} with id {id}")
 
-    xml = read_xml(get_object_redis(nr, id))
-    session.put(f"{editor_uri}/app/vocabs/profile/clarin.eu%3Acr1%3Ap_1653377925723/record/{nr}",
-                headers={"content-type": "application/xml"}, body=xml)
+        xml = read_xml(get_object_redis(nr, id))
+        session.put(f"{editor_uri}/app/vocabs/profile/clarin.eu%3Acr1%3Ap_1653377925723/record/{nr}",
+                    headers={"content-type": "application/xml"}, body=xml)
 
-    delete_object_redis(nr, id)
-    log.info(f"Finished work for {nr} with id {id}")
+        log.info(f"Finished work for {nr} with id {id}")
+    finally:
+        delete_object_redis(nr, id)
 
 
 def get_files_in_path(path: str) -> list[str]:
@@ -68,3 +75,13 @@ def get_files_in_path(path: str) -> list[str]:
             if dirpath == path:
                 return [os.path.join(dirpath, f) for f in filenames]
         return []
+
+
+def run_per_version(task: Task, subtasks: List[Signature], callback: Signature) -> Any:
+    # Fan out one subtask per version over the workers and merge the results in the callback;
+    # when called outside a worker, executed eagerly (or with nothing to fan out), the subtasks are simply run one by one
+    if task.request.called_directly or task.request.is_eager or not subtasks:
+        # Eager results are already computed, so getting them within a task does not block
+        results = [subtask.apply().get(disable_sync_subtasks=False) for subtask in subtasks]
+        return callback.apply(args=(results,)).get(disable_sync_subtasks=False)
+    return task.replace(chord(subtasks, callback))
@@ -4,6 +4,7 @@ import elementpath
 from lxml import etree
 from lxml.etree import Element
 from inspect import cleandoc
+from functools import lru_cache
 
 ns = {"cmd": "http://www.clarin.eu/cmd/"}
 ns_prefix = '{http://www.clarin.eu/cmd/}'
@@ -26,8 +27,29 @@ def grab_first(path: str, root: Element) -> Element:
 
 
 def grab_value(path, root, func=None):
-    content = elementpath.select(root, path, ns)
-    if content and type(content[0]) == str:
+    return normalize_value(elementpath.select(root, path, ns), func)
+
+
+@lru_cache(maxsize=1024)
+def compile_xpath(path: str) -> etree.XPath:
+    return etree.XPath(path, namespaces=ns, smart_strings=False)
+
+
+def xpath_select(path: str, root: Element) -> list:
+    return compile_xpath(path)(root)
+
+
+def xpath_first(path: str, root: Element) -> Element:
+    content = compile_xpath(path)(root)
+    return content[0] if content else None
+
+
+def xpath_value(path, root, func=None):
+    return normalize_value(compile_xpath(path)(root), func)
+
+
+def normalize_value(content: list, func=None):
+    if content and isinstance(content[0], str):
         content = unicodedata.normalize("NFKC", content[0]).strip()
     elif content and content[0].text is not None:
         content = unicodedata.normalize("NFKC", content[0].text).strip()